@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+#
+# Benchmarks loading, preparing, pre-pacing and simulating every bundled
+# model.
+#
+# Usage: python benchmark.py [group ...] [-o results.json] [-c base.json]
+#                           [--pre-pace-all]
+#
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import myokit
+
+import registry
+import shared
+
+
+# Phases timed for every model, in order
+phases = ('load', 'convert', 'compile', 'pre_pace', 'run')
+
+
+def _git(*args):
+    """ Returns the output of a git command, or ``None`` if it fails. """
+    try:
+        p = subprocess.run(
+            ('git', ) + args, capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return p.stdout.strip()
+
+
+def model_files():
+    """
+    Returns a list of tuples ``(group, name, filename)`` for every model file
+    in ``registry.models_dir``, using the registry name where available and
+    the filename otherwise.
+    """
+    files = []
+    for group in sorted(os.listdir(registry.models_dir)):
+        path = os.path.join(registry.models_dir, group)
+        if not os.path.isdir(path):
+            continue
+        names = {}
+        if group in registry.groups:
+            names = {v['file']: k
+                     for k, v in registry.groups[group]['models'].items()}
+        for fname in sorted(os.listdir(path)):
+            if fname.endswith('.mmt'):
+                files.append((group, names.get(fname, fname[:-4]), fname))
+    return files
+
+
+def benchmark_model(group, name, fname, pre_pace_all=False):
+    """
+    Loads, prepares, compiles, pre-paces and simulates a single model, and
+    returns a dict with the wall time for each of the ``phases``, the number
+    of beats simulated while pre-pacing and the final pre-pacing ``status``
+    (see :meth:`shared.limit_cycle`), and the peak memory use of the process.
+
+    Models and groups that are not pre-paced by the figure scripts are not
+    pre-paced here either, and are reported with ``pre_pace=None`` and
+    ``status=None``, unless ``pre_pace_all=True``. Compiled simulations and
+    pre-paced states are never taken from the cache.
+    """
+    g = registry.groups.get(group, {})
+    entry = g.get('models', {}).get(name, {})
+    protocol = registry.protocol(group) if g else myokit.pacing.blocktrain(
+        1000, duration=0.5, offset=50)
+    result = {'group': group, 'name': name, 'file': fname}
+
+    t = time.perf_counter()
+    model = myokit.load_model(os.path.join(registry.models_dir, group, fname))
+    result['load'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    if 'preprocess' in entry:
+        entry['preprocess'](model)
+    if entry:
+        currents = registry.current_variables(group, name)
+    else:
+        currents = shared.guess_currents(model)
+    shared.convert_units(model, currents)
+    result['convert'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    s = shared.create_simulation(model, protocol, cache=False)
+    result['compile'] = time.perf_counter() - t
+
+    result['pre_pace'] = None
+    result['beats'] = 0
+    result['status'] = None
+    pre_pace = g.get('pre_pace', True) and entry.get('pre_pace', True)
+    if pre_pace_all or (pre_pace and 'koiv' not in model.name()):
+        t = time.perf_counter()
+        state, info = shared.limit_cycle(
+            model, protocol, simulation=s, diagnostics=True)
+        result['pre_pace'] = time.perf_counter() - t
+        model.set_state(state)
+        result['beats'] = info['beats']
+        result['status'] = info['status']
+
+    t = time.perf_counter()
+    s.reset()
+    s.set_state(model.state())
+    s.set_tolerance(1e-8, 1e-8)
+    s.run(g.get('tmax', 800), log=shared.log_variables(model, currents))
+    result['run'] = time.perf_counter() - t
+
+    # Peak resident set size, in MiB (ru_maxrss is in KiB on Linux)
+    result['peak_memory'] = resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def _benchmark_job(args):
+    """ Runs :meth:`benchmark_model` in a worker, catching any errors. """
+    try:
+        return benchmark_model(*args)
+    except Exception as e:
+        group, name, fname = args[:3]
+        return {'group': group, 'name': name, 'file': fname,
+                'error': type(e).__name__ + ': ' + str(e).split('\n')[0]}
+
+
+def benchmark(groups=None, pre_pace_all=False):
+    """
+    Benchmarks all models in ``groups`` (or all groups, if not set), and
+    returns a dict with information about the environment and a list of
+    results from :meth:`benchmark_model` under ``models``. With
+    ``pre_pace_all=True``, every model is pre-paced, including those that the
+    figure scripts don't pre-pace.
+
+    Each model is run in a fresh (forked) process, one at a time, so that
+    timings don't interfere and memory use is measured per model.
+    """
+    jobs = [x + (pre_pace_all, ) for x in model_files()
+            if groups is None or x[0] in groups]
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            results = list(pool.imap(_benchmark_job, jobs, chunksize=1))
+    else:
+        results = [_benchmark_job(job) for job in jobs]
+
+    return {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'myokit': myokit.__version__,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'pre_pace_all': pre_pace_all,
+        'models': results,
+    }
+
+
+def _total(result):
+    """
+    Returns the total time for a result, or ``None`` if it failed or is
+    missing.
+    """
+    if not result or 'error' in result:
+        return None
+    return sum(result[x] or 0 for x in phases)
+
+
+def report(results, base=None):
+    """
+    Prints a table of ``results`` from :meth:`benchmark`, slowest model first.
+
+    If ``base`` results are given, the ratio of each time to the time in
+    ``base`` is shown too.
+    """
+    old = {}
+    if base is not None:
+        old = {(x['group'], x['name']): x for x in base['models']}
+
+    print('Commit: ' + str(results['commit'])
+          + (' (modified)' if results['dirty'] else ''))
+    if base is not None:
+        print('Compared to: ' + str(base['commit']))
+        if base.get('pre_pace_all') != results.get('pre_pace_all'):
+            print('WARNING: Only one run pre-paced all models.')
+    header = ['model'] + list(phases) + ['total', 'beats', 'MiB', 'status']
+    print(header[0].ljust(24) + ' '.join(x.rjust(9) for x in header[1:]))
+
+    models = sorted(results['models'], key=lambda x: -(_total(x) or 0))
+    for r in models:
+        name = (r['group'] + '/' + r['name']).ljust(23)
+        if 'error' in r:
+            print(name + ' ' + r['error'])
+            continue
+        o = old.get((r['group'], r['name']), {})
+        row = [name]
+        for key in phases + ('total', ):
+            value = _total(r) if key == 'total' else r[key]
+            ref = _total(o) if key == 'total' else o.get(key)
+            if value is None:
+                row.append('-'.rjust(9))
+            elif ref:
+                row.append(('x' + format(value / ref, '.2f')).rjust(9))
+            else:
+                row.append(format(value, '.3f').rjust(9))
+        row.append(str(r['beats']).rjust(9))
+        row.append(format(r['peak_memory'], '.0f').rjust(9))
+        row.append(str(r.get('status') or '-').rjust(9))
+        print(' '.join(row))
+
+
+def main(args=None):
+    """ Runs the command line interface. """
+    parser = argparse.ArgumentParser(
+        description='Benchmark preparing and simulating all models.')
+    parser.add_argument(
+        'groups', nargs='*', metavar='group',
+        help='The model groups to benchmark (default: all)')
+    parser.add_argument(
+        '-o', '--output',
+        help='JSON file to write (default: benchmark-<commit>.json)')
+    parser.add_argument(
+        '-c', '--compare', metavar='BASE',
+        help='JSON file from an earlier run to compare with')
+    parser.add_argument(
+        '--pre-pace-all', action='store_true',
+        help='Pre-pace every model, including those the figure scripts'
+        ' don\'t pre-pace')
+    args = parser.parse_args(args)
+
+    base = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            base = json.load(f)
+
+    results = benchmark(args.groups or None, args.pre_pace_all)
+    path = args.output
+    if path is None:
+        path = 'benchmark-' + (results['commit'] or 'unknown')[:7] + '.json'
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=1)
+    print('Results written to ' + path)
+    report(results, base)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+#
+# Builds the relative contribution figures, re-simulating only the panels
+# that are out of date.
+#
+# Usage: python figures.py [group ...] [-m model ...] [--force] [--dry-run]
+#                           [--headless]
+#
+# Matplotlib is only imported when a figure is drawn, so that simulating and
+# storing traces (e.g. with --headless) works without pyplot.
+#
+# Simulated traces are kept in the trace store (see shared.store_traces), and
+# can be loaded for analysis with load_traces(group).
+#
+import argparse
+import inspect
+import itertools
+import multiprocessing
+import os
+import sys
+
+import myokit
+import numpy as np
+
+import registry
+import shared
+
+
+# Directory to store figures in
+figure_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Matplotlib styles, set when pyplot is first used
+styles = {
+    'axes.spines.right': False,
+    'axes.spines.top': False,
+    'mathtext.default': 'regular',
+}
+
+# Name of the matplotlib colormap used for currents
+colormap = 'tab20'
+
+# Maximum error when decimating traces for plotting, in relative contribution
+# units (the y-axis of each panel spans about 250 pixels at 100 dpi)
+decimate_tolerance = 0.002
+
+# Panels with more vertices than this are rasterized
+rasterize_vertices = 200000
+
+
+def _source(path):
+    """ Returns the contents of the file at ``path``. """
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def panel_key(group, name):
+    """
+    Returns a key identifying the simulation for the panel of model ``name``
+    in ``group``.
+
+    The key is a hash of the model file, ``shared.py``, the model's registry
+    entry, the group's protocol and pre-pacing setting, and the duration, and
+    is used to store the simulated traces with :meth:`shared.store_traces`.
+    """
+    g = registry.groups[group]
+    entry = dict(g['models'][name])
+    entry.pop('title')
+    entry.pop('panel')
+    entry.pop('yaxis', None)
+    if 'preprocess' in entry:
+        entry['preprocess'] = inspect.getsource(entry['preprocess'])
+    return shared.cache_key(
+        _source(os.path.join(registry.models_dir, group, entry['file'])),
+        _source(shared.__file__),
+        inspect.getsource(simulate_panels),
+        sorted(entry.items()),
+        registry.protocol(group).code(), g.get('pre_pace', True), g['tmax'])
+
+
+def figure_key(group, panel_keys):
+    """
+    Returns a key identifying the figure for ``group``, drawn from panels with
+    the given ``panel_keys``.
+    """
+    g = registry.groups[group]
+    layout = [(k, v['title'], v['panel'], v.get('yaxis'))
+              for k, v in g['models'].items()]
+    return shared.cache_key(
+        _source(__file__), layout, g['hidden'], sorted(g['legend'].items()),
+        panel_keys)
+
+
+def load_traces(group, names=None):
+    """
+    Returns a dict mapping model names in ``group`` to a
+    :class:`myokit.DataLog` with their stored time, membrane potential and
+    current traces (in that order), for all models (or all ``names``) that
+    have up to date traces.
+
+    The arrays are memory-mapped, so loading is cheap even for many models.
+    """
+    if names is None:
+        names = registry.groups[group]['models']
+    logs = {}
+    for name in names:
+        log = shared.load_traces(panel_key(group, name))
+        if log is not None:
+            logs[name] = log
+    return logs
+
+
+def simulate_panels(group, names, **kwargs):
+    """
+    Loads, prepares and simulates the models ``names`` in ``group``, and
+    stores the time, membrane potential and current traces for each panel,
+    in that order.
+
+    Any keyword arguments are passed to :meth:`registry.prepare`.
+    """
+    g = registry.groups[group]
+    models, simulations = registry.prepare(group, names, **kwargs)
+    for name in names:
+        model = models[name]
+        currents = registry.current_variables(group, name)
+        log = shared.log_variables(model, currents)
+        log.insert(1, model.labelx('membrane_potential').qname())
+        d = simulations[name].run(g['tmax'], log=log)
+        shared.store_traces(panel_key(group, name), d, log)
+
+
+def iter_simulate(group, names, processes=None):
+    """
+    Starts simulating the panels for models ``names`` in ``group`` (see
+    :meth:`simulate_panels`), and returns an iterator that yields each name as
+    soon as its traces have been stored.
+
+    Each model is loaded, compiled, pre-paced and simulated in its own worker
+    process, using at most ``processes`` processes (defaults to the number of
+    CPUs). The workers are started immediately, so that other work can be
+    done before iterating.
+    """
+    def job(name):
+        simulate_panels(group, [name], processes=1)
+        return name
+
+    return shared.fork_map(job, names, processes, ordered=False)
+
+
+def decimate_log(log, currents, tolerance=None):
+    """
+    Returns a copy of ``log`` with only the time and ``currents``, at the
+    points needed to draw the stacked relative contributions within the given
+    ``tolerance`` (defaults to ``decimate_tolerance``).
+    """
+    if tolerance is None:
+        tolerance = decimate_tolerance
+    time = log.time_key()
+    t = np.asarray(log[time])
+    i = shared.decimate(t, shared.stacked_contributions(
+        [log[x] for x in currents]), tolerance)
+    d = myokit.DataLog(time=time)
+    d[time] = t[i]
+    for x in currents:
+        d[x] = np.asarray(log[x])[i]
+    return d
+
+
+def _pyplot():
+    """
+    Imports pyplot, applies the ``styles``, and returns pyplot.
+
+    Figures are only ever stored, so if pyplot has not been imported yet the
+    non-interactive Agg backend is selected first (which also makes it safe
+    to fork in :meth:`export`).
+    """
+    import matplotlib
+    if 'matplotlib.pyplot' not in sys.modules:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    matplotlib.rcParams.update(styles)
+    return plt
+
+
+def _colours(keys):
+    """ Returns the colours for the given current keys. """
+    import matplotlib
+    cmap = matplotlib.colormaps[colormap]
+    return [cmap(shared.current_colours[x]) for x in keys]
+
+
+def draw_panel(ax, group, name, log):
+    """
+    Draws the panel for model ``name`` in ``group`` on axes ``ax``.
+
+    The log is decimated before drawing (see :meth:`decimate_log`), and
+    panels that still have more than ``rasterize_vertices`` vertices are
+    rasterized, to keep vector output small.
+    """
+    import myokit.lib.plots as mp
+    g = registry.groups[group]
+    entry = g['models'][name]
+    currents = registry.currents(group, name)
+    colours = _colours(currents)
+    ax.set_title(entry['title'])
+    ax.set_xlabel('Time (s)')
+    yaxis = entry.get('yaxis')
+    if yaxis == 'label':
+        ax.set_ylabel('Relative contribution')
+    elif yaxis is None:
+        ax.set_yticklabels([])
+    ax.set_xlim(0, g['tmax'])
+    ax.set_ylim(-1.02, 1.02)
+    log = decimate_log(log, list(currents.values()))
+    raster = {}
+    if len(log.time()) * len(currents) > rasterize_vertices:
+        raster['rasterized'] = True
+    mp.cumulative_current(
+        log, list(currents.values()), ax, colors=colours, normalize=True,
+        line_args=dict(raster), fill_args=dict(raster))
+
+
+def draw_legend(ax, group):
+    """ Draws the current colour legend for ``group`` on axes ``ax``. """
+    import matplotlib.lines
+    ax.xaxis.set_visible(False)
+    ax.yaxis.set_visible(False)
+    ax.set_frame_on(False)
+    keys = registry.colour_keys(group)
+    lines = []
+    for colour in _colours(keys):
+        lines.append(matplotlib.lines.Line2D([0], [0], color=colour, lw=5))
+    labels = [shared.current_names[x] for x in keys]
+    ax.legend(lines, labels, **registry.groups[group]['legend'])
+
+
+def create_figure():
+    """ Returns a tuple ``(fig, grid)`` with an empty figure and its grid. """
+    from matplotlib.gridspec import GridSpec
+    fig = _pyplot().figure(figsize=(9, 9))
+    fig.subplots_adjust(0.075, 0.05, 0.98, 0.97, hspace=0.35, wspace=0.2)
+    return fig, GridSpec(3, 3)
+
+
+def export(fig, group):
+    """
+    Closes ``fig`` and stores it as PNG and PDF, in background processes.
+
+    Returns a list of processes to wait for, which is empty if the figure was
+    stored in this process. This happens if forking is not supported, or if
+    an interactive backend is in use (forking a process with e.g. a GUI event
+    loop is unsafe).
+    """
+    plt = _pyplot()
+    paths = [os.path.join(figure_dir, group + x) for x in ('.png', '.pdf')]
+    if 'fork' not in multiprocessing.get_all_start_methods() or (
+            plt.get_backend().lower() != 'agg'):
+        for path in paths:
+            fig.savefig(path)
+        plt.close(fig)
+        return []
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=fig.savefig, args=(x, ))
+                 for x in paths]
+    for p in processes:
+        p.start()
+    plt.close(fig)
+    return processes
+
+
+def build(groups=None, names=None, force=False, dry_run=False,
+          processes=None, headless=False):
+    """
+    Builds the figures for ``groups`` (or all groups, if not set),
+    re-simulating only panels that are missing or out of date and redrawing
+    only figures whose panels or layout changed.
+
+    Out of date panels are simulated in worker processes, while up to date
+    panels and finished simulations are drawn in the main process. Figures
+    are exported in the background, while the next group is processed.
+
+    Arguments
+    ``groups``
+        A list of group names.
+    ``names``
+        An optional list of model names, each of which must be in one of the
+        ``groups``. If set, only these models can be re-simulated, and figures
+        with any other out of date panels are skipped.
+    ``force``
+        Set to ``True`` to re-simulate all panels or, if ``names`` is set, all
+        panels for ``names``.
+    ``dry_run``
+        Set to ``True`` to only print what would be done.
+    ``processes``
+        The maximum number of processes to simulate with (defaults to the
+        number of CPUs).
+    ``headless``
+        Set to ``True`` to only simulate and store out of date panels, without
+        drawing figures or importing matplotlib.
+    """
+    if groups is None:
+        groups = list(registry.groups)
+    for group in groups:
+        if group not in registry.groups:
+            raise ValueError('Unknown figure: ' + str(group))
+    for name in names or []:
+        if not any(name in registry.groups[x]['models'] for x in groups):
+            raise ValueError('Unknown model: ' + str(name))
+
+    exports = []
+    for group in groups:
+        models = registry.groups[group]['models']
+
+        # Find stale panels
+        keys = {}
+        stale = []
+        for name in models:
+            keys[name] = panel_key(group, name)
+            forced = force and (names is None or name in names)
+            if forced or shared.load_traces(keys[name]) is None:
+                stale.append(name)
+        todo = [x for x in stale if names is None or x in names]
+        skip = [x for x in stale if x not in todo]
+        if todo:
+            print('Simulating ' + group + ': ' + ', '.join(todo))
+
+        # Simulate only
+        if skip or headless:
+            if not dry_run:
+                for name in iter_simulate(group, todo, processes):
+                    pass
+            if skip:
+                print('Skipping ' + group + ', out of date: '
+                      + ', '.join(skip))
+            continue
+
+        # Check if figure is up to date
+        key = figure_key(group, [keys[x] for x in models])
+        path = shared.cache_path('figures', group, '.txt')
+        outputs = [os.path.join(figure_dir, group + x)
+                   for x in ('.png', '.pdf')]
+        if not todo and os.path.isfile(path) and all(
+                os.path.isfile(x) for x in outputs):
+            with open(path, 'r') as f:
+                if f.read() == key:
+                    print('Up to date: ' + group)
+                    continue
+        print('Drawing ' + group)
+        if dry_run:
+            continue
+
+        # Draw stored panels, then simulated panels as they arrive
+        fig, grid = create_figure()
+        simulated = iter_simulate(group, todo, processes)
+        ready = [x for x in models if x not in todo]
+        for name in itertools.chain(ready, simulated):
+            row, col = models[name]['panel']
+            draw_panel(fig.add_subplot(grid[row, col]), group, name,
+                       shared.load_traces(keys[name]))
+        draw_legend(fig.add_subplot(grid[1, 2]), group)
+        exports.append((group, key, path, export(fig, group)))
+
+    # Wait for exports, and store keys of completed figures
+    for group, key, path, jobs in exports:
+        for p in jobs:
+            p.join()
+        if any(p.exitcode != 0 for p in jobs):
+            print('Failed to store figure: ' + group)
+        else:
+            with open(path, 'w') as f:
+                f.write(key)
+
+
+def main(args=None):
+    """ Runs the command line interface. """
+    parser = argparse.ArgumentParser(
+        description='Build relative contribution figures.')
+    parser.add_argument(
+        'groups', nargs='*', metavar='group',
+        help='The figures to build: ' + ', '.join(registry.groups)
+        + ' (default: all)')
+    parser.add_argument(
+        '-m', '--model', action='append', dest='names',
+        help='Only re-simulate this model (can be given multiple times)')
+    parser.add_argument(
+        '-f', '--force', action='store_true',
+        help='Re-simulate all selected panels')
+    parser.add_argument(
+        '-n', '--dry-run', action='store_true',
+        help='Show what would be done, without doing it')
+    parser.add_argument(
+        '-j', '--jobs', type=int, dest='processes',
+        help='Maximum number of simulation processes (default: all CPUs)')
+    parser.add_argument(
+        '--headless', action='store_true',
+        help='Only simulate and store traces, without drawing figures')
+    args = parser.parse_args(args)
+    build(args.groups or None, args.names, args.force, args.dry_run,
+          args.processes, args.headless)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+#
+# Per-beat and per-phase charge shares of the major ionic currents.
+#
+# Usage: python metrics.py [group ...] [-o output.csv]
+#
+import argparse
+import csv
+import sys
+
+import numpy as np
+
+import registry
+
+
+# Phases reported for every beat, in order
+phases = ('beat', 'upstroke', 'plateau', 'repolarisation', 'rest')
+
+# Columns of the tables returned by charge_shares and group_metrics
+columns = ('model', 'beat', 'phase', 'current', 'outward_charge',
+           'inward_charge', 'outward_share', 'inward_share')
+
+
+def phase_boundaries(t, v, starts, plateau=0.3, repolarised=0.9):
+    """
+    Returns an array of shape ``(beats, 5)`` with the times at which each
+    beat starts, reaches its peak, leaves the plateau, is repolarised, and
+    ends.
+
+    Arguments
+    ``t``
+        The logged times.
+    ``v``
+        The logged membrane potential.
+    ``starts``
+        The times at which beats start. A beat ends when the next one starts,
+        and the last beat ends at the final logged time.
+    ``plateau``
+        The fraction of repolarisation (relative to the amplitude of the
+        action potential) that ends the plateau phase.
+    ``repolarised``
+        The fraction of repolarisation that ends the repolarisation phase.
+    """
+    starts = np.asarray(starts, dtype=float)
+    ends = np.append(starts[1:], t[-1])
+    lo = np.searchsorted(t, starts)
+    hi = np.searchsorted(t, ends, side='right')
+
+    bounds = np.empty((len(starts), 5))
+    bounds[:, 0] = starts
+    bounds[:, 4] = ends
+    for k in range(len(starts)):
+        vb = v[lo[k]:hi[k]]
+        if len(vb) < 2:
+            bounds[k, 1:4] = ends[k]
+            continue
+        i = np.argmax(vb)
+        amplitude = vb[i] - vb[0]
+        for j, f in enumerate((plateau, repolarised)):
+            below = np.nonzero(vb[i:] < vb[i] - f * amplitude)[0]
+            if len(below):
+                bounds[k, 2 + j] = t[lo[k] + i + below[0]]
+            else:
+                bounds[k, 2 + j] = ends[k]
+        bounds[k, 1] = t[lo[k] + i]
+    return bounds
+
+
+def _interpolate(t, y, x):
+    """
+    Linearly interpolates the arrays ``y`` of shape ``(..., times)`` at the
+    times ``x``, returning an array of shape ``(..., len(x))``.
+    """
+    i = np.clip(np.searchsorted(t, x, side='right') - 1, 0, len(t) - 2)
+    dt = t[i + 1] - t[i]
+    w = np.clip((x - t[i]) / np.where(dt > 0, dt, 1), 0, 1)
+    return y[..., i] * (1 - w) + y[..., i + 1] * w
+
+
+def charge_shares(t, v, currents, starts, plateau=0.3, repolarised=0.9):
+    """
+    Calculates the outward and inward charge carried by each current, for
+    every beat and every phase in ``phases``, and each current's share of the
+    total outward and inward charge.
+
+    Arguments
+    ``t``
+        The logged times.
+    ``v``
+        The logged membrane potential, used to detect the phases (see
+        :meth:`phase_boundaries`).
+    ``currents``
+        An array of shape ``(currents, times)``.
+    ``starts``
+        The times at which beats start.
+    ``plateau``, ``repolarised``
+        The repolarisation fractions used to define phases.
+
+    Returns a tuple ``(charges, shares)``, each an array of shape
+    ``(2, currents, beats, phases)``, where the first index selects outward
+    (0) or inward (1) charge. Inward charges are returned as positive
+    numbers.
+    """
+    t = np.asarray(t, dtype=float)
+    currents = np.asarray(currents, dtype=float)
+
+    # Cumulative outward and inward charge, for all currents in one pass
+    parts = np.stack((np.maximum(currents, 0), -np.minimum(currents, 0)))
+    q = np.zeros(parts.shape)
+    np.cumsum(0.5 * (parts[..., 1:] + parts[..., :-1]) * np.diff(t), axis=-1,
+              out=q[..., 1:])
+
+    # Charge between phase boundaries
+    bounds = phase_boundaries(t, v, starts, plateau, repolarised)
+    nb = len(bounds)
+    qb = _interpolate(t, q, bounds.ravel()).reshape(q.shape[:2] + (nb, 5))
+    charges = np.empty(q.shape[:2] + (nb, len(phases)))
+    charges[..., 0] = qb[..., 4] - qb[..., 0]
+    charges[..., 1:] = np.diff(qb, axis=-1)
+
+    # Shares of total charge
+    total = np.sum(charges, axis=1, keepdims=True)
+    shares = charges / np.where(total > 0, total, 1)
+    return charges, shares
+
+
+def _membrane_potential(log):
+    """
+    Returns the name of the membrane potential in a log stored by
+    :meth:`figures.simulate_panels`: the first variable after the time.
+    """
+    for key in log:
+        if key != log.time_key():
+            return key
+    raise ValueError('Unable to find membrane potential in log.')
+
+
+def group_metrics(group, logs=None, plateau=0.3, repolarised=0.9):
+    """
+    Returns a table (a list of tuples with fields ``columns``) of charge
+    shares for all models in ``group``.
+
+    Arguments
+    ``group``
+        The group name, as used in ``registry``.
+    ``logs``
+        An optional dict mapping model names to logs containing the time,
+        membrane potential and currents, in that order. If not set, the logs
+        stored by the figure driver are used (see :meth:`figures.load_traces`).
+    ``plateau``, ``repolarised``
+        The repolarisation fractions used to define phases.
+
+    Currents are identified by their keys in ``shared.current_colours``, so
+    that rows for different models can be compared.
+    """
+    if logs is None:
+        import figures
+        logs = figures.load_traces(group)
+    g = registry.groups[group]
+    offset = g['stimulus'][1]
+
+    rows = []
+    for name, log in logs.items():
+        currents = registry.currents(group, name)
+        keys, variables = list(currents.keys()), list(currents.values())
+        t = np.asarray(log.time())
+        v = np.asarray(log[_membrane_potential(log)])
+        starts = np.arange(offset, t[-1], g['cl'])
+        charges, shares = charge_shares(
+            t, v, [log[x] for x in variables], starts, plateau, repolarised)
+        for b in range(len(starts)):
+            for p, phase in enumerate(phases):
+                for k, key in enumerate(keys):
+                    rows.append((
+                        name, b, phase, key,
+                        float(charges[0, k, b, p]), float(charges[1, k, b, p]),
+                        float(shares[0, k, b, p]), float(shares[1, k, b, p])))
+    return rows
+
+
+def write_csv(rows, f, header=columns):
+    """
+    Writes a table from :meth:`group_metrics` to a file object ``f``, preceded
+    by the given ``header``.
+    """
+    w = csv.writer(f)
+    w.writerow(header)
+    w.writerows(rows)
+
+
+def main(args=None):
+    """ Runs the command line interface. """
+    parser = argparse.ArgumentParser(
+        description='Calculate per-phase charge shares from stored traces.')
+    parser.add_argument(
+        'groups', nargs='*', metavar='group',
+        help='The groups to process: ' + ', '.join(registry.groups)
+        + ' (default: all)')
+    parser.add_argument(
+        '-o', '--output', help='CSV file to write (default: stdout)')
+    args = parser.parse_args(args)
+
+    rows = []
+    for group in args.groups or registry.groups:
+        if group not in registry.groups:
+            raise ValueError('Unknown group: ' + str(group))
+        rows.extend((group,) + row for row in group_metrics(group))
+    if not rows:
+        print('No stored traces found, run figures.py first.')
+        return
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            write_csv(rows, f, ('group',) + columns)
+    else:
+        write_csv(rows, sys.stdout, ('group',) + columns)
+
+
+if __name__ == '__main__':
+    main()
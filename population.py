@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+#
+# Relative contributions in populations of models with scaled currents.
+#
+import myokit
+import numpy as np
+
+import shared
+
+
+def add_scalings(model, currents):
+    """
+    Adds a scaling factor for every current in ``currents`` to a ``model``,
+    and returns a list with the name of each factor.
+
+    Each factor is added as a literal constant (initially 1) in the current's
+    component, so that it can be changed in a compiled simulation with
+    :meth:`myokit.Simulation.set_constant`. The current's equation is then
+    multiplied by this factor. Currents defined as a sum of other variables
+    (e.g. ``ICaL_total = ICaL + ICaNa + ICaK``) are scaled by multiplying the
+    terms of the sum instead, so that any other equations using these terms
+    (e.g. for ion concentrations) see the same scaling.
+    """
+    names = []
+    for qname in currents:
+        var = model.get(qname)
+        factor = var.parent().add_variable_allow_renaming(
+            var.name() + '_scale')
+        factor.set_rhs(1)
+        factor.set_unit(myokit.units.dimensionless)
+        for x in _terms(var):
+            x.set_rhs(myokit.Multiply(myokit.Name(factor), x.rhs()))
+        names.append(factor.qname())
+    return names
+
+
+def _terms(var):
+    """
+    Returns the variables whose equations should be scaled to scale ``var``.
+    """
+    e = var.rhs()
+    while isinstance(e, (myokit.PrefixPlus, myokit.PrefixMinus)):
+        e = e[0]
+    if isinstance(e, myokit.Name) and not e.var().is_state():
+        return _terms(e.var())
+    if isinstance(e, (myokit.Plus, myokit.Minus)):
+        names = []
+        todo = [e]
+        while todo:
+            e = todo.pop()
+            if isinstance(e, (myokit.Plus, myokit.Minus)):
+                todo.extend(e)
+            elif isinstance(e, (myokit.PrefixPlus, myokit.PrefixMinus)):
+                todo.append(e[0])
+            elif isinstance(e, myokit.Name) and not e.var().is_state():
+                names.append(e.var())
+            else:
+                return [var]
+        terms = []
+        for x in names:
+            terms.extend(_terms(x))
+        return terms
+    return [var]
+
+
+def lognormal_scalings(n, currents, sigma=0.2, seed=None):
+    """
+    Returns an array of shape ``(n, len(currents))`` with scaling factors
+    drawn from a log-normal distribution with median 1 and shape ``sigma``.
+    """
+    r = np.random.default_rng(seed)
+    return np.exp(r.normal(0, sigma, size=(n, len(currents))))
+
+
+def run_population(model, protocol, currents, scalings, duration,
+                   log_interval=1, pre_pace=True, quantiles=(0.05, 0.5, 0.95),
+                   processes=None, cache=True, tolerance=(1e-8, 1e-8)):
+    """
+    Calculates the relative contributions of ``currents`` in a population of
+    variants of ``model``.
+
+    Arguments
+    ``model``
+        A model prepared with :meth:`shared.prepare_model`. Its state is used
+        as the initial state of every variant.
+    ``protocol``
+        The protocol to simulate.
+    ``currents``
+        The current variable names, e.g. as returned by a
+        ``current_variables`` function.
+    ``scalings``
+        An array of shape ``(n, len(currents))`` with the factor to scale each
+        current by in each variant.
+    ``duration``
+        The duration of the simulation to log.
+    ``log_interval``
+        The interval to log the currents at (in ms). Logging is denser just
+        after each stimulus, see :meth:`shared.log_times`.
+    ``pre_pace``
+        Set to ``False`` to log the variants without first running
+        :meth:`shared.limit_cycle` for each.
+    ``quantiles``
+        The quantiles to calculate across the population.
+    ``processes``
+        The maximum number of worker processes to use (defaults to the number
+        of CPUs).
+    ``cache``
+        Set to ``False`` to disable loading and storing the compiled
+        simulation.
+    ``tolerance``
+        The solver tolerances to use for the logged simulations.
+
+    The scaling factors are added to a copy of the model with
+    :meth:`add_scalings`, which is compiled only once. The variants are then
+    simulated in a pool of worker processes forked from the current process,
+    which re-use the compiled simulation and differ only in their scaling
+    factors. Variants for which the simulation fails are set to ``NaN``, and
+    are ignored when calculating the mean and quantiles.
+
+    Returns a tuple ``(times, contributions, mean, bands)``, where ``times``
+    is an array of logged times, ``contributions`` is an array of shape
+    ``(n, len(currents), len(times))`` as returned by
+    :meth:`shared.relative_contributions`, ``mean`` is the mean over all
+    variants, and ``bands`` has shape
+    ``(len(quantiles), len(currents), len(times))``.
+    """
+    scalings = np.array(scalings, dtype=float, ndmin=2)
+    if scalings.shape[1] != len(currents):
+        raise ValueError(
+            'Expecting one scaling per current, got ' + str(scalings.shape[1])
+            + ' for ' + str(len(currents)) + ' currents.')
+    n = len(scalings)
+    times = shared.log_times(protocol, duration, log_interval)
+
+    # Create and compile scalable model
+    model = model.clone()
+    factors = add_scalings(model, currents)
+    s = shared.create_simulation(model, protocol, cache)
+
+    settings = (model, protocol, s, currents, factors, scalings, duration,
+                times, pre_pace, tolerance)
+
+    # Simulate
+    i = np.empty((n, len(currents), len(times)))
+    results = shared.fork_map(
+        lambda j: _population_job(settings, j), range(n), processes,
+        chunksize=None)
+    for j, x in enumerate(results):
+        i[j] = x
+
+    # Normalise and get statistics
+    contributions = shared.relative_contributions(i)
+    mean = np.nanmean(contributions, axis=0)
+    bands = np.nanquantile(contributions, quantiles, axis=0)
+    return times, contributions, mean, bands
+
+
+def _population_job(settings, j):
+    """
+    Simulates the ``j``-th variant with the ``settings`` from
+    :meth:`run_population`, and returns an array of shape
+    ``(currents, times)``.
+    """
+    (model, protocol, s, currents, factors, scalings, duration, times,
+     pre_pace, tolerance) = settings
+    for name, value in zip(factors, scalings[j]):
+        s.set_constant(name, value)
+
+    try:
+        state = model.state()
+        if pre_pace:
+            state = shared.limit_cycle(model, protocol, simulation=s)
+        s.set_tolerance(*tolerance)
+        s.set_time(0)
+        s.set_state(state)
+        d = s.run(duration, log=currents, log_times=times)
+    except myokit.SimulationError as e:
+        print('WARNING: Simulation of variant ' + str(j) + ' failed: '
+              + str(e))
+        return np.nan
+    return np.array([d[c] for c in currents])
@@ -0,0 +1,663 @@
+#!/usr/bin/env python3
+#
+# Registry of models, their currents, and how to prepare them.
+#
+# Only the standard library is imported at the top level, so that the model
+# maps can be used (e.g. by worker processes) without loading myokit.
+#
+import os
+
+
+# Directory containing the model groups
+models_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+
+
+def _stewart_totals(model):
+    """ Adds summed Ito and If variables to the Stewart 2009 model. """
+    c = model.get('ito')
+    v = c.add_variable('i_to_total')
+    v.set_unit(c.get('i_to').unit())
+    v.set_rhs('ito.i_to + isus.i_sus')
+    c = model.get('if')
+    v = c.add_variable('i_f_total')
+    v.set_unit(c.get('i_f_Na').unit())
+    v.set_rhs('i_f_Na + i_f_K')
+
+
+def _sampson_totals(model):
+    """ Adds summed Ito and ICaL variables to the Sampson 2010 model. """
+    c = model.get('ito')
+    v = c.add_variable('Ito_total')
+    v.set_unit(c.get('Ito1').unit())
+    v.set_rhs('ito.Ito1 + isus.Isus')
+    c = model.get('ical')
+    v = c.add_variable('ICaL_total')
+    v.set_unit(c.get('ICa').unit())
+    v.set_rhs('ICa + ICaK')
+
+
+def _trovato_totals(model):
+    """ Adds summed Ito, ICaL and INaCa variables to the Trovato model. """
+    c = model.get('Ito')
+    v = c.add_variable('Ito_total')
+    v.set_unit(c.get('Ito').unit())
+    v.set_rhs('Ito.Ito + Isus.Isus')
+    c = model.get('ICaL')
+    v = c.add_variable('ICaL_total')
+    v.set_unit(c.get('ICaL').unit())
+    v.set_rhs('ICaL + ICaK + ICaNa')
+    c = model.get('INaCa_i')
+    v = c.add_variable('INaCa_total')
+    v.set_unit(c.get('INaCa_i').unit())
+    v.set_rhs('INaCa_i.INaCa_i + INaCa_ss.INaCa_ss')
+
+
+#
+# Model groups. Each group has a directory in ``models_dir`` and contains:
+#
+# ``cl``
+#   The cycle length to pace at.
+# ``stimulus``
+#   A tuple ``(duration, offset)`` for the stimulus.
+# ``hidden``
+#   Keys of ``shared.current_colours`` that are not shown in the legend.
+# ``pre_pace``
+#   Optional, set to ``False`` to disable pre-pacing for all models.
+# ``tmax``
+#   The duration to show in figures.
+# ``legend``
+#   Keyword arguments ``loc`` and ``ncol`` for the figure legend, which is
+#   drawn in panel ``(1, 2)``.
+# ``models``
+#   An ordered dict mapping model names to dicts with entries:
+#
+#   ``file``
+#       The model file name.
+#   ``title``
+#       The title to show in figures.
+#   ``panel``
+#       The ``(row, column)`` of the model's panel in a 3 by 3 figure grid.
+#   ``yaxis``
+#       Optional, set to ``'label'`` to show a y-axis label and tick labels,
+#       or to ``'ticks'`` to show only tick labels. Both are hidden by
+#       default.
+#   ``pre_pace``
+#       Optional, set to ``False`` to disable pre-pacing.
+#   ``preprocess``
+#       Optional, a function ``f(model)`` to call after loading.
+#   ``currents``
+#       An ordered dict mapping keys of ``shared.current_colours`` to current
+#       variable names.
+#
+groups = {
+    'atrial': {
+        'cl': 1000,
+        'stimulus': (0.5, 50),
+        'hidden': ['I_CaT', 'I_K,ATP'],
+        'tmax': 800,
+        'legend': {'loc': (0.05, -0.7), 'ncol': 1},
+        'models': {
+            'courtemanche': {
+                'file': 'courtemanche-1998.mmt',
+                'title': 'Courtemanche et al., 1998',
+                'panel': (1, 0),
+                'yaxis': 'label',
+                'currents': {
+                    'I_NaCa': 'inaca.i_NaCa',
+                    'I_Kur': 'ikur.i_Kur',
+                    'I_to': 'ito.i_to',
+                    'I_CaL': 'ical.i_Ca_L',
+                    'I_Kr': 'ikr.i_Kr',
+                    'I_Ks': 'iks.i_Ks',
+                    'I_K1': 'ik1.i_K1',
+                    'I_NaK': 'inak.i_NaK',
+                    'I_Ca,P': 'ipca.i_PCa',
+                    'I_Ca,B': 'ib.i_B_Ca',
+                    'I_Na,B': 'ib.i_B_Na',
+                    'I_Na': 'ina.i_Na',
+                },
+            },
+            'grandi': {
+                'file': 'grandi-2011.mmt',
+                'title': 'Grandi-Pandit-Voigt et al., 2011',
+                'panel': (2, 0),
+                'yaxis': 'label',
+                'currents': {
+                    'I_Cl,B': 'iclb.IClB',
+                    'I_Kur': 'ikur.IKur',
+                    'I_to': 'ito.Ito',
+                    'I_CaL': 'ical.ICaL',
+                    'I_NaCa': 'inaca.INaCa',
+                    'I_Kr': 'ikr.IKr',
+                    'I_Ks': 'iks.IKs',
+                    'I_K1': 'ik1.IK1',
+                    'I_NaK': 'inak.INaK',
+                    'I_Ca,P': 'ipca.IpCa',
+                    'I_Ca,B': 'icab.ICaB',
+                    'I_Na,B': 'inab.INaB',
+                    'I_ClCa': 'iclca.IClCa',
+                    'I_Kb': 'ikp.IKp',
+                    'I_Na': 'ina.INa',
+                    'I_NaL': 'inal.INaL',
+                },
+            },
+            'koivumaki': {
+                'file': 'koivumaki-2011.mmt',
+                'title': 'Koivumaki et al., 2011',
+                'panel': (0, 2),
+                'pre_pace': False,
+                'currents': {
+                    'I_Kur': 'ikur.IKur',
+                    'I_to': 'it.It',
+                    'I_CaL': 'ical.ICaL',
+                    'I_NaCa': 'inaca.INaCa',
+                    'I_Kr': 'ikr.IKr',
+                    'I_Ks': 'iks.IKs',
+                    'I_K1': 'ik1.IK1',
+                    'I_NaK': 'inak.INaK',
+                    'I_Ca,P': 'icap.ICaP',
+                    'I_Ca,B': 'icab.ICab',
+                    'I_Na,B': 'inab.INab',
+                    'I_f': 'if.If',
+                    'I_Na': 'ina.INa',
+                },
+            },
+            'maleckar': {
+                'file': 'maleckar-2008.mmt',
+                'title': 'Maleckar et al., 2008',
+                'panel': (0, 1),
+                'currents': {
+                    'I_Kur': 'ikur.i_Kur',
+                    'I_to': 'it.i_t',
+                    'I_CaL': 'ical.i_Ca_L',
+                    'I_NaCa': 'inaca.i_NaCa',
+                    'I_Kr': 'ikr.i_Kr',
+                    'I_Ks': 'iks.i_Ks',
+                    'I_K1': 'ik1.i_K1',
+                    'I_NaK': 'inak.i_NaK',
+                    'I_Ca,P': 'icap.i_CaP',
+                    'I_Ca,B': 'ib.i_B_Ca',
+                    'I_Na,B': 'ib.i_B_Na',
+                    'I_K,ACh': 'ikach.i_KACh',
+                    'I_Na': 'ina.i_Na',
+                },
+            },
+            'ni': {
+                'file': 'ni-2017.mmt',
+                'title': 'Ni et al., 2017',
+                'panel': (1, 1),
+                'currents': {
+                    'I_Kur': 'ikur.IKur',
+                    'I_to': 'ito.Ito',
+                    'I_CaL': 'ical.ICaL',
+                    'I_NaCa': 'inaca.INaCa',
+                    'I_Kr': 'ikr.IKr',
+                    'I_Ks': 'iks.IKs',
+                    'I_K1': 'ik1.IK1',
+                    'I_NaK': 'inak.INaK',
+                    'I_Ca,P': 'icap.ICap',
+                    'I_Ca,B': 'ibca.IbCa',
+                    'I_Na,B': 'ibna.IbNa',
+                    'I_Na': 'ina.INa',
+                },
+            },
+            'nygren': {
+                'file': 'nygren-1998.mmt',
+                'title': 'Nygren et al., 1998',
+                'panel': (0, 0),
+                'yaxis': 'label',
+                'currents': {
+                    'I_Kur': 'isus.i_sus',
+                    'I_to': 'it.i_t',
+                    'I_CaL': 'ical.iCaL',
+                    'I_NaCa': 'inaca.i_NaCa',
+                    'I_Kr': 'ikr.i_Kr',
+                    'I_Ks': 'iks.i_Ks',
+                    'I_K1': 'ik1.i_K1',
+                    'I_NaK': 'inak.i_NaK',
+                    'I_Ca,P': 'icap.i_CaP',
+                    'I_Ca,B': 'ib.i_B_Ca',
+                    'I_Na,B': 'ib.i_B_Na',
+                    'I_Na': 'ina.i_Na',
+                },
+            },
+            'voigt': {
+                'file': 'voigt-heijman-2013.mmt',
+                'title': 'Voigt-Heijman et al., 2013',
+                'panel': (2, 1),
+                'currents': {
+                    'I_Cl,B': 'iclb.IClB',
+                    'I_Kur': 'ikur.IKur',
+                    'I_to': 'ito.Ito',
+                    'I_CaL': 'ical.ICaL',
+                    'I_NaCa': 'inaca.INaCa',
+                    'I_Kr': 'ikr.IKr',
+                    'I_Ks': 'iks.IKs',
+                    'I_K1': 'ik1.IK1',
+                    'I_NaK': 'inak.INaK',
+                    'I_Ca,P': 'ipca.IpCa',
+                    'I_Ca,B': 'icab.ICaB',
+                    'I_Na,B': 'inab.INaB',
+                    'I_K,ACh': 'ikach.IKACh',
+                    'I_ClCa': 'iclca.IClCa',
+                    'I_Kb': 'ikp.IKp',
+                    'I_Na': 'ina.INa',
+                    'I_NaL': 'inal.INaL',
+                },
+            },
+        },
+    },
+    'ventricular': {
+        'cl': 1000,
+        'stimulus': (0.5, 50),
+        'hidden': ['I_f', 'I_Kur', 'I_CaT'],
+        'pre_pace': False,
+        'tmax': 800,
+        'legend': {'loc': (-0.13, 0.05), 'ncol': 2},
+        'models': {
+            'priebe': {
+                'file': 'priebe-1998.mmt',
+                'title': 'Priebe & Beuckelmann, 1998',
+                'panel': (0, 0),
+                'yaxis': 'label',
+                'currents': {
+                    'I_NaCa': 'inaca.i_NaCa',
+                    'I_to': 'ito.i_to',
+                    'I_Ks': 'iks.i_Ks',
+                    'I_Kr': 'ikr.i_Kr',
+                    'I_K1': 'ik1.i_K1',
+                    'I_NaK': 'inak.i_NaK',
+                    'I_CaL': 'ica.i_Ca',
+                    'I_Ca,B': 'icab.i_b_Ca',
+                    'I_Na,B': 'inab.i_b_Na',
+                    'I_Na': 'ina.i_Na',
+                },
+            },
+            'iyer': {
+                'file': 'iyer-2004.mmt',
+                'title': 'Iyer et al., 2004 (epi)',
+                'panel': (0, 1),
+                'currents': {
+                    'I_NaCa': 'inaca.inaca',
+                    'I_to': 'ito.Ito1',
+                    'I_Ks': 'iks.iks',
+                    'I_Kr': 'ikr.ikr',
+                    'I_Ca,P': 'ipca.ipca',
+                    'I_K1': 'ik1.ik1',
+                    'I_NaK': 'inak.inak',
+                    'I_CaL': 'ical.ICa_total',
+                    'I_Ca,B': 'icab.icab',
+                    'I_Na,B': 'inab.inab',
+                    'I_Na': 'ina.ina',
+                },
+            },
+            'grandi': {
+                'file': 'grandi-2010.mmt',
+                'title': 'Grandi et al., 2010 (epi)',
+                'panel': (0, 2),
+                'currents': {
+                    'I_Cl,B': 'iclb.IClb',
+                    'I_ClCa': 'iclca.iclca',
+                    'I_to': 'ito.ito',
+                    'I_Kb': 'ikp.I_kp',
+                    'I_Ks': 'iks.I_ks',
+                    'I_Kr': 'ikr.I_kr',
+                    'I_Ca,P': 'ipca.I_pca',
+                    'I_K1': 'ik1.I_k1',
+                    'I_NaK': 'inak.I_nak',
+                    'I_CaL': 'ical.I_CaL',
+                    'I_NaCa': 'incx.I_ncx',
+                    'I_Ca,B': 'icabk.I_cabk',
+                    'I_Na,B': 'inab.I_nabk',
+                    'I_Na': 'ina.I_Na',
+                },
+            },
+            'tnnp': {
+                'file': 'tentusscher-2004.mmt',
+                'title': 'Ten Tusscher et al., 2004 (epi)',
+                'panel': (1, 0),
+                'yaxis': 'label',
+                'currents': {
+                    'I_NaCa': 'inaca.INaCa',
+                    'I_to': 'ito.Ito',
+                    'I_Kb': 'ipk.IpK',
+                    'I_Ks': 'iks.IKs',
+                    'I_Kr': 'ikr.IKr',
+                    'I_K1': 'ik1.IK1',
+                    'I_NaK': 'inak.INaK',
+                    'I_Ca,P': 'ipca.IpCa',
+                    'I_CaL': 'ical.ICaL',
+                    'I_Ca,B': 'icab.ICab',
+                    'I_Na,B': 'inab.INab',
+                    'I_Na': 'ina.INa',
+                },
+            },
+            'tp': {
+                'file': 'tentusscher-2006.mmt',
+                'title': 'Ten Tusscher & Panfilov 2006 (epi)',
+                'panel': (1, 1),
+                'currents': {
+                    'I_to': 'ito.Ito',
+                    'I_Kb': 'ipk.IpK',
+                    'I_Ks': 'iks.IKs',
+                    'I_Kr': 'ikr.IKr',
+                    'I_K1': 'ik1.IK1',
+                    'I_NaCa': 'inaca.INaCa',
+                    'I_NaK': 'inak.INaK',
+                    'I_Ca,P': 'ipca.IpCa',
+                    'I_CaL': 'ical.ICaL',
+                    'I_Ca,B': 'icab.ICab',
+                    'I_Na,B': 'inab.INab',
+                    'I_Na': 'ina.INa',
+                },
+            },
+            'ohara': {
+                'file': 'ohara-2011.mmt',
+                'title': "O'Hara et al., 2011 (epi)",
+                'panel': (2, 0),
+                'yaxis': 'label',
+                'currents': {
+                    'I_to': 'ito.Ito',
+                    'I_Kb': 'ikb.IKb',
+                    'I_Ks': 'iks.IKs',
+                    'I_Kr': 'ikr.IKr',
+                    'I_Ca,P': 'ipca.IpCa',
+                    'I_K1': 'ik1.IK1',
+                    'I_NaK': 'inak.INaK',
+                    'I_CaL': 'ical.ICaL_total',
+                    'I_NaL': 'inal.INaL',
+                    'I_NaCa': 'inaca.INaCa_total',
+                    'I_Ca,B': 'icab.ICab',
+                    'I_Na,B': 'inab.INab',
+                    'I_Na': 'ina.INa',
+                },
+            },
+            'cipa': {
+                'file': 'ohara-cipa-v1-2017.mmt',
+                'title': "O'Hara et al., 2017 CiPA (epi)",
+                'panel': (2, 1),
+                'currents': {
+                    'I_to': 'ito.Ito',
+                    'I_Kb': 'ikb.IKb',
+                    'I_Ks': 'iks.IKs',
+                    'I_Kr': 'ikr.IKr',
+                    'I_Ca,P': 'ipca.IpCa',
+                    'I_K1': 'ik1.IK1',
+                    'I_NaK': 'inak.INaK',
+                    'I_CaL': 'ical.ICaL_total',
+                    'I_NaL': 'inal.INaL',
+                    'I_NaCa': 'inaca.INaCa_total',
+                    'I_Ca,B': 'icab.ICab',
+                    'I_Na,B': 'inab.INab',
+                    'I_Na': 'ina.INa',
+                },
+            },
+            'tomek': {
+                'file': 'tomek-2020-chloride-epi.mmt',
+                'title': 'Tomek et al., 2020 (epi)',
+                'panel': (2, 2),
+                'currents': {
+                    'I_Cl,B': 'ICl.IClb',
+                    'I_ClCa': 'ICl.IClCa',
+                    'I_to': 'Ito.Ito',
+                    'I_Kb': 'IKb.IKb',
+                    'I_Ks': 'IKs.IKs',
+                    'I_Kr': 'IKr.IKr',
+                    'I_K,ATP': 'I_katp.I_katp',
+                    'I_Ca,P': 'IpCa.IpCa',
+                    'I_K1': 'IK1.IK1',
+                    'I_NaK': 'INaK.INaK',
+                    'I_CaL': 'ICaL.ICaL',
+                    'I_NaL': 'INaL.INaL',
+                    'I_NaCa': 'INaCa.INaCa',
+                    'I_Ca,B': 'ICab.ICab',
+                    'I_Na,B': 'INab.INab',
+                    'I_Na': 'INa.INa',
+                },
+            },
+        },
+    },
+    'purkinje': {
+        'cl': 1000,
+        'stimulus': (0.5, 50),
+        'hidden': ['I_Kur', 'I_ClCa', 'I_Cl,B', 'I_K,ACh', 'I_K,ATP'],
+        'tmax': 800,
+        'legend': {'loc': (0.05, -0.7), 'ncol': 1},
+        'models': {
+            'sampson': {
+                'file': 'sampson-2010.mmt',
+                'title': 'Sampson-Iyer et al., 2010',
+                'panel': (1, 0),
+                'preprocess': _sampson_totals,
+                'currents': {
+                    'I_NaCa': 'inaca.INaCa',
+                    'I_to': 'ito.Ito_total',
+                    'I_Kr': 'ikr.IKr',
+                    'I_Ks': 'iks.IKs',
+                    'I_f': 'ihcn.IHCN',
+                    'I_K1': 'ik1.IK1',
+                    'I_NaK': 'inak.INaK',
+                    'I_CaL': 'ical.ICaL_total',
+                    'I_CaT': 'icat.I',
+                    'I_Ca,P': 'ipca.IpCa',
+                    'I_NaL': 'nav11.INa1',
+                    'I_Na': 'nav15.INa',
+                },
+            },
+            'stewart': {
+                'file': 'stewart-2009.mmt',
+                'title': 'Stewart et al., 2009',
+                'panel': (0, 0),
+                'yaxis': 'label',
+                'pre_pace': False,
+                'preprocess': _stewart_totals,
+                'currents': {
+                    'I_to': 'ito.i_to_total',
+                    'I_Kr': 'ikr.i_Kr',
+                    'I_Ks': 'iks.i_Ks',
+                    'I_Kb': 'ipk.i_p_K',
+                    'I_f': 'if.i_f_total',
+                    'I_K1': 'ik1.i_K1',
+                    'I_NaK': 'inak.i_NaK',
+                    'I_CaL': 'ical.i_CaL',
+                    'I_NaCa': 'inaca.i_NaCa',
+                    'I_Na,B': 'ibna.i_b_Na',
+                    'I_Ca,B': 'ibca.i_b_Ca',
+                    'I_Ca,P': 'ipca.i_p_Ca',
+                    'I_Na': 'ina.i_Na',
+                },
+            },
+            'trovato': {
+                'file': 'trovato-2020.mmt',
+                'title': 'Trovato et al., 2020',
+                'panel': (2, 0),
+                'preprocess': _trovato_totals,
+                'currents': {
+                    'I_to': 'Ito.Ito_total',
+                    'I_Kr': 'IKr.IKr',
+                    'I_Ks': 'IKs.IKs',
+                    'I_f': 'If.If',
+                    'I_K1': 'IK1.IK1',
+                    'I_NaK': 'INaK.INaK',
+                    'I_CaL': 'ICaL.ICaL_total',
+                    'I_CaT': 'ICaT.ICaT',
+                    'I_NaL': 'INaL.INaL',
+                    'I_NaCa': 'INaCa_i.INaCa_total',
+                    'I_Na,B': 'INab.INab',
+                    'I_Ca,B': 'ICab.ICab',
+                    'I_Ca,P': 'IpCa.IpCa',
+                    'I_Na': 'INa.INa',
+                },
+            },
+        },
+    },
+    'hipsc': {
+        'cl': 800,
+        'stimulus': (5, 50),
+        'hidden': ['I_Kb', 'I_Kur', 'I_ClCa', 'I_Cl,B', 'I_K,ACh', 'I_K,ATP'],
+        'tmax': 800,
+        'legend': {'loc': (0.05, -0.7), 'ncol': 1},
+        'models': {
+            'paci-2013': {
+                'file': 'paci-2013-ventricular.mmt',
+                'title': 'Paci et al. 2013 (ventricular)',
+                'panel': (0, 0),
+                'yaxis': 'label',
+                'currents': {
+                    'I_NaCa': 'inaca.INaCa',
+                    'I_to': 'ito.Ito',
+                    'I_Kr': 'ikr.IKr',
+                    'I_Ks': 'iks.IKs',
+                    'I_f': 'if.If',
+                    'I_K1': 'ik1.IK1',
+                    'I_NaK': 'inak.INaK',
+                    'I_CaL': 'ical.ICaL',
+                    'I_Na,B': 'ibna.IbNa',
+                    'I_Ca,B': 'ibca.IbCa',
+                    'I_Ca,P': 'ipca.IpCa',
+                    'I_Na': 'ina.INa',
+                },
+            },
+            'paci-2018': {
+                'file': 'paci-2018.mmt',
+                'title': 'Paci et al. 2018',
+                'panel': (0, 1),
+                'yaxis': 'ticks',
+                'currents': {
+                    'I_NaCa': 'inaca.INaCa',
+                    'I_to': 'ito.Ito',
+                    'I_Kr': 'ikr.IKr',
+                    'I_Ks': 'iks.IKs',
+                    'I_f': 'if.If',
+                    'I_K1': 'ik1.IK1',
+                    'I_NaK': 'inak.INaK',
+                    'I_CaL': 'ical.ICaL',
+                    'I_NaL': 'inal.INaL',
+                    'I_Na,B': 'ibna.IbNa',
+                    'I_Ca,B': 'ibca.IbCa',
+                    'I_Ca,P': 'ipca.IpCa',
+                    'I_Na': 'ina.INa',
+                },
+            },
+            'paci-2020': {
+                'file': 'paci-2020.mmt',
+                'title': 'Paci et al. 2020',
+                'panel': (0, 2),
+                'yaxis': 'ticks',
+                'currents': {
+                    'I_NaCa': 'inaca.INaCa',
+                    'I_to': 'ito.Ito',
+                    'I_Kr': 'ikr.IKr',
+                    'I_Ks': 'iks.IKs',
+                    'I_f': 'if.If',
+                    'I_K1': 'ik1.IK1',
+                    'I_NaK': 'inak.INaK',
+                    'I_CaL': 'ical.ICaL',
+                    'I_NaL': 'inal.INaL',
+                    'I_Na,B': 'ibna.IbNa',
+                    'I_Ca,B': 'ibca.IbCa',
+                    'I_Ca,P': 'ipca.IpCa',
+                    'I_Na': 'ina.INa',
+                },
+            },
+            'kernik': {
+                'file': 'kernik-2019.mmt',
+                'title': 'Kernik et al. 2019',
+                'panel': (1, 0),
+                'yaxis': 'label',
+                'pre_pace': False,
+                'currents': {
+                    'I_NaCa': 'inaca.i_NaCa',
+                    'I_to': 'ito.i_to',
+                    'I_Kr': 'ikr.i_Kr',
+                    'I_Ks': 'iks.i_Ks',
+                    'I_f': 'ifunny.i_f',
+                    'I_K1': 'ik1.i_K1',
+                    'I_NaK': 'inak.i_NaK',
+                    'I_CaL': 'ical.i_CaL',
+                    'I_CaT': 'icat.i_CaT',
+                    'I_Na,B': 'ibna.i_b_Na',
+                    'I_Ca,B': 'ibca.i_b_Ca',
+                    'I_Ca,P': 'ipca.i_PCa',
+                    'I_Na': 'ina.i_Na',
+                },
+            },
+        },
+    },
+}
+
+
+def protocol(group, cl=None):
+    """
+    Returns the pacing protocol for the given ``group``, using the group's
+    cycle length or ``cl``, if given.
+    """
+    import myokit
+    g = groups[group]
+    duration, offset = g['stimulus']
+    if cl is None:
+        cl = g['cl']
+    return myokit.pacing.blocktrain(cl, duration=duration, offset=offset)
+
+
+def currents(group, name):
+    """
+    Returns an ordered dict mapping colour keys to current variable names,
+    for the model ``name`` in ``group``.
+    """
+    return dict(groups[group]['models'][name]['currents'])
+
+
+def current_variables(group, name):
+    """
+    Returns an ordered list of transmembrane current variable names, for the
+    model ``name`` in ``group``.
+    """
+    return list(groups[group]['models'][name]['currents'].values())
+
+
+def colour_keys(group):
+    """
+    Returns the keys of ``shared.current_colours`` that are shown in the
+    legend for ``group``.
+    """
+    import shared
+    hidden = groups[group]['hidden']
+    return [x for x in shared.current_colours if x not in hidden]
+
+
+def titles(group):
+    """ Returns a dict mapping model names in ``group`` to their titles. """
+    return {k: v['title'] for k, v in groups[group]['models'].items()}
+
+
+def prepare(group, names=None, **kwargs):
+    """
+    Loads and prepares the models ``names`` (or all models, if not set) from
+    the given ``group``, using :meth:`shared.prepare_models`.
+
+    Only the requested models are loaded, converted, and pre-paced. Any
+    further keyword arguments are passed to :meth:`shared.prepare_models`.
+
+    Returns a tuple ``(models, simulations)``.
+    """
+    import shared
+    g = groups[group]
+    if names is None:
+        names = list(g['models'])
+    entries = {name: g['models'][name] for name in names}
+    preprocess = {
+        k: v['preprocess'] for k, v in entries.items() if 'preprocess' in v}
+
+    pre_pace = g.get('pre_pace', True)
+    if pre_pace:
+        pre_pace = {k: v.get('pre_pace', True) for k, v in entries.items()}
+
+    return shared.prepare_models(
+        os.path.join(models_dir, group),
+        {k: v['file'] for k, v in entries.items()},
+        protocol(group),
+        {k: list(v['currents'].values()) for k, v in entries.items()},
+        pre_pace=pre_pace,
+        preprocess=preprocess,
+        **kwargs)
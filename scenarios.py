@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+#
+# Shifts in relative contributions under fractional block of ionic currents.
+#
+# Usage: python scenarios.py group -b I_Kr=0.5 -b I_CaL=0.3,I_Kr=0.5
+#
+import argparse
+
+import myokit
+import numpy as np
+
+import population
+import registry
+import shared
+
+
+def block_scalings(currents, block):
+    """
+    Returns a list with the factor to scale each current by under the given
+    ``block``.
+
+    Arguments
+    ``currents``
+        An ordered dict mapping current keys (as used in
+        ``shared.current_colours``) to variable names, e.g. as returned by
+        :meth:`registry.currents`.
+    ``block``
+        A dict mapping current keys to the fraction blocked, from 0 (no block)
+        to 1 (full block). Keys not in ``currents`` are ignored.
+    """
+    for key, fraction in block.items():
+        if not 0 <= fraction <= 1:
+            raise ValueError(
+                'Block of ' + str(key) + ' must be between 0 and 1, got '
+                + str(fraction) + '.')
+    return [1 - block.get(key, 0) for key in currents]
+
+
+def parse_block(text):
+    """
+    Parses a block specification such as ``'I_Kr=0.5,I_CaL=0.3'`` and returns
+    a dict mapping current keys to blocked fractions.
+    """
+    block = {}
+    for part in text.split(','):
+        key, eq, value = part.partition('=')
+        if not eq:
+            raise ValueError('Expecting current=fraction, got ' + part + '.')
+        block[key.strip()] = float(value)
+    return block
+
+
+def run_scenarios(models, currents, protocol, scenarios, duration,
+                  log_interval=1, processes=None, cache=True,
+                  tolerance=(1e-8, 1e-8)):
+    """
+    Calculates the relative contributions of currents in every model, both
+    without block (``'control'``) and in each drug-block scenario.
+
+    Arguments
+    ``models``
+        A dict mapping names to models prepared with
+        :meth:`shared.prepare_model`.
+    ``currents``
+        A dict mapping the same names to ordered dicts of current keys and
+        variable names, e.g. as returned by :meth:`registry.currents`.
+    ``protocol``
+        The protocol to simulate.
+    ``scenarios``
+        A dict mapping scenario names to dicts of blocked fractions, e.g.
+        ``{'dofetilide': {'I_Kr': 0.5}}``. See :meth:`block_scalings`.
+    ``duration``
+        The duration of the simulation to log.
+    ``log_interval``
+        The interval to log the currents at (in ms), see
+        :meth:`shared.log_times`.
+    ``processes``
+        The maximum number of worker processes to use (defaults to the number
+        of CPUs).
+    ``cache``
+        Set to ``False`` to disable loading and storing compiled simulations.
+    ``tolerance``
+        The solver tolerances to use for the logged simulations.
+
+    Scaling factors are added to a copy of each model with
+    :meth:`population.add_scalings`, which is compiled only once. The control
+    limit cycle is found first (starting from the prepared state), after
+    which every scenario is pre-paced with :meth:`shared.limit_cycle`
+    starting from the control limit cycle. Both stages run in a pool of
+    worker processes forked from the current process, which re-use the
+    compiled simulations and differ only in their scaling factors. Scenarios
+    for which the simulation fails are set to ``NaN``.
+
+    Returns a tuple ``(times, results)``, where ``times`` is an array of
+    logged times and ``results`` maps model names to dicts that map
+    ``'control'`` and each scenario name to an array of shape
+    ``(currents, times)`` as returned by
+    :meth:`shared.relative_contributions`.
+    """
+    if 'control' in scenarios:
+        raise ValueError('The name "control" is reserved for the control.')
+    times = shared.log_times(protocol, duration, log_interval)
+
+    # Create and compile scalable models
+    names = list(models)
+    settings = []
+    for name in names:
+        model = models[name].clone()
+        variables = list(currents[name].values())
+        factors = population.add_scalings(model, variables)
+        s = shared.create_simulation(model, protocol, cache)
+        settings.append(
+            (model, protocol, s, variables, factors, duration, times,
+             tolerance))
+        for block in scenarios.values():
+            for key in block:
+                if key not in currents[name]:
+                    print('WARNING: No ' + str(key) + ' in ' + name + '.')
+
+    def job(args):
+        i, scalings, state = args
+        return _scenario_job(settings[i], scalings, state)
+
+    # Find control limit cycles
+    jobs = [(i, [1] * len(settings[i][3]), None) for i in range(len(names))]
+    controls = list(shared.fork_map(job, jobs, processes))
+
+    # Warm-start every scenario from the control
+    jobs = []
+    for i, name in enumerate(names):
+        for block in scenarios.values():
+            jobs.append((i, block_scalings(currents[name], block),
+                         controls[i][0]))
+    outputs = iter(list(shared.fork_map(job, jobs, processes)))
+
+    # Normalise
+    results = {}
+    for i, name in enumerate(names):
+        r = {'control': controls[i][1]}
+        for key in scenarios:
+            r[key] = next(outputs)[1]
+        for key, c in r.items():
+            if c is None:
+                r[key] = np.full((len(currents[name]), len(times)), np.nan)
+            else:
+                r[key] = shared.relative_contributions(c)
+        results[name] = r
+    return times, results
+
+
+def mean_shifts(times, results):
+    """
+    Returns a dict mapping every model and scenario in ``results`` (as
+    returned by :meth:`run_scenarios`) to an array with the shift in the
+    time-averaged relative contribution of each current, compared to the
+    control.
+
+    Each array has shape ``(2, currents)``, with the shifts in outward
+    contributions in the first row and the shifts in inward contributions
+    in the second.
+    """
+    w = np.diff(times) / (2 * (times[-1] - times[0]))
+
+    def average(c):
+        parts = np.stack((np.maximum(c, 0), np.minimum(c, 0)))
+        return np.sum((parts[..., 1:] + parts[..., :-1]) * w, axis=-1)
+
+    shifts = {}
+    for name, r in results.items():
+        control = average(r['control'])
+        shifts[name] = {
+            k: average(v) - control for k, v in r.items() if k != 'control'}
+    return shifts
+
+
+def _scenario_job(settings, scalings, state):
+    """
+    Pre-paces and simulates a scalable model with the given ``settings`` (as
+    created by :meth:`run_scenarios`) and ``scalings``, starting from the
+    given ``state`` (or the model state, if ``None``).
+
+    Returns a tuple ``(state, currents)`` where ``currents`` has shape
+    ``(currents, times)``, or ``(None, None)`` if the simulation failed.
+    """
+    (model, protocol, s, variables, factors, duration, times,
+     tolerance) = settings
+    for name, value in zip(factors, scalings):
+        s.set_constant(name, value)
+
+    try:
+        model = model.clone()
+        if state is not None:
+            model.set_state(state)
+        state = shared.limit_cycle(model, protocol, simulation=s)
+        s.set_tolerance(*tolerance)
+        s.set_time(0)
+        s.set_state(state)
+        d = s.run(duration, log=variables, log_times=times)
+    except myokit.SimulationError as e:
+        print('WARNING: Simulation of ' + model.name() + ' failed: '
+              + str(e))
+        return None, None
+    return state, np.array([d[c] for c in variables])
+
+
+def run_group(group, scenarios, names=None, processes=None):
+    """
+    Prepares the models ``names`` (or all models) in ``group`` with
+    :meth:`registry.prepare`, and runs :meth:`run_scenarios` for the group's
+    protocol, logging up to the group's ``tmax``.
+
+    The unscaled simulations compiled by :meth:`registry.prepare` are only
+    used to find the pre-paced states (both are cached, see
+    :meth:`shared.prepare_models`), from which the control limit cycles of
+    the scaled models are started. Both stages use at most ``processes``
+    worker processes.
+    """
+    if names is None:
+        names = list(registry.groups[group]['models'])
+    models, _ = registry.prepare(group, names, processes=processes)
+    currents = {x: registry.currents(group, x) for x in names}
+    return run_scenarios(
+        models, currents, registry.protocol(group), scenarios,
+        registry.groups[group]['tmax'], processes=processes)
+
+
+def main(args=None):
+    """ Runs the command line interface. """
+    parser = argparse.ArgumentParser(
+        description='Calculate shifts in relative contributions under block.')
+    parser.add_argument(
+        'group', choices=list(registry.groups),
+        help='The group of models to use')
+    parser.add_argument(
+        '-b', '--block', action='append', required=True,
+        help='A scenario, e.g. I_Kr=0.5,I_CaL=0.3 (can be given multiple'
+        ' times)')
+    parser.add_argument(
+        '-m', '--model', action='append', dest='names',
+        help='Only use this model (can be given multiple times)')
+    parser.add_argument(
+        '-j', '--jobs', type=int, dest='processes',
+        help='Maximum number of worker processes (default: all CPUs)')
+    args = parser.parse_args(args)
+
+    scenarios = {x: parse_block(x) for x in args.block}
+    times, results = run_group(
+        args.group, scenarios, args.names, args.processes)
+    shifts = mean_shifts(times, results)
+    for name, r in shifts.items():
+        keys = list(registry.currents(args.group, name))
+        for scenario, shift in r.items():
+            print(name + ', ' + scenario + ':')
+            for k, key in enumerate(keys):
+                print('  ' + key.ljust(8) + format(shift[0, k], '+.3f')
+                      + ' ' + format(shift[1, k], '+.3f'))
+
+
+if __name__ == '__main__':
+    main()
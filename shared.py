@@ -2,10 +2,30 @@
 #
 # Shared code for model current "relative contribution" graphs.
 #
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import time
+
 import myokit
 import numpy as np
 
 
+# Directory to cache pre-paced states and other intermediate results in
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+
+# Maximum size (in bytes) of each cache subdirectory
+cache_size = 50 * 1024 * 1024
+
+# Functions that instrumentation events are sent to, see add_sink
+_sinks = []
+
+
 current_colours = {
     'I_Kr': 0,
     'I_Ks': 1,
@@ -53,7 +73,9 @@ current_names = {
 }
 
 
-def prepare_model(model, protocol, currents, pre_pace=True):
+def prepare_model(model, protocol, currents, pre_pace=True, cache=True,
+                  tolerance=(1e-8, 1e-8), accelerate=False,
+                  method='limit_cycle'):
     """
     Prepares a model by setting the desired units, adding a voltage-clamp
     switch, and pre-pacing.
@@ -65,7 +87,188 @@ def prepare_model(model, protocol, currents, pre_pace=True):
     - ``membrane_capacitance`` (units unchanged)
     - All variables in ``currents``, in A/F
 
-    Pre-pacing can be disabled by setting ``pre_pace=False``.
+    Pre-pacing can be disabled by setting ``pre_pace=False``. Pre-paced
+    states are stored in (and loaded from) the ``cache_dir``, unless
+    ``cache=False`` is set. Accelerated pre-pacing can be enabled with
+    ``accelerate=True``, see :meth:`limit_cycle`. To find the steady state
+    with :meth:`periodic_orbit` instead, set ``method='periodic_orbit'``.
+
+    Returns a :class:`myokit.Simulation` for the model and protocol, set to
+    the pre-paced state and using the solver tolerances ``tolerance``. The
+    same simulation is used for pre-pacing, so that the model is compiled only
+    once. Compiled simulations are cached too, see
+    :meth:`create_simulation`.
+    """
+    if method not in _methods:
+        raise ValueError('Unknown pre-pacing method: ' + str(method))
+    convert_units(model, currents)
+    s = create_simulation(model, protocol, cache)
+
+    # Pre-pace
+    if pre_pace and not 'koiv' in model.name():
+        path = None
+        if cache:
+            path = _state_path(model, protocol, accelerate, method)
+        if path is not None and os.path.isfile(path):
+            _load_state(model, path)
+        else:
+            print('Pre-pacing: ' + model.name())
+            emit('cache', model.name(), kind='state', hit=False)
+            state = _pre_pace(model, protocol, s, accelerate, method)
+            _store_state(model, state, path)
+        print(model.format_state(model.state()))
+    else:
+        print('NOT Pre-pacing: ' + model.name())
+
+    return _reset_simulation(s, model, tolerance)
+
+
+def prepare_models(path, model_names, protocol, current_variables,
+                   pre_pace=True, preprocess=None, cache=True,
+                   processes=None, tolerance=(1e-8, 1e-8),
+                   accelerate=False, method='limit_cycle'):
+    """
+    Loads and prepares a group of models, pre-pacing them in parallel.
+
+    Arguments
+    ``path``
+        The directory containing the model files.
+    ``model_names``
+        A dict mapping model names to file names.
+    ``protocol``
+        The protocol to pre-pace with.
+    ``current_variables``
+        A function that returns the list of current variable names for a
+        model, or a dict mapping model names to such lists.
+    ``pre_pace``
+        Set to ``False`` to disable pre-pacing for all models, or pass in a
+        dict mapping model names to ``True`` or ``False``. Models not in the
+        dict are pre-paced.
+    ``preprocess``
+        An optional function ``preprocess(name, model)`` that is called on
+        each model after loading, before any units are converted, or a dict
+        mapping model names to functions ``preprocess(model)``.
+    ``cache``
+        Set to ``False`` to disable loading and storing pre-paced states and
+        compiled simulations.
+    ``processes``
+        The maximum number of worker processes to use for pre-pacing (defaults
+        to the number of CPUs).
+    ``tolerance``
+        The solver tolerances to set on the returned simulations.
+    ``accelerate``
+        Set to ``True`` to use accelerated pre-pacing, see
+        :meth:`limit_cycle`.
+    ``method``
+        Set to ``'periodic_orbit'`` to find steady states with
+        :meth:`periodic_orbit` instead of :meth:`limit_cycle`.
+
+    Each model is loaded, converted, and compiled into a simulation as in
+    :meth:`prepare_model`, after which :meth:`limit_cycle` is run for all
+    models (that need it and are not cached) in a process pool, with one model
+    per worker (see :meth:`fork_map`). The workers are forked from the current
+    process, so that they can re-use the compiled simulations. If forking is
+    not supported, models are pre-paced one after the other. With
+    ``method='periodic_orbit'``, models are also handled one after the other,
+    but each model's Jacobians are evaluated in parallel.
+
+    Returns a tuple ``(models, simulations)``, where ``models`` is a dict
+    mapping model names to prepared models, and ``simulations`` is a dict
+    mapping the same names to simulations set to the pre-paced states. Both
+    dicts have the same order as ``model_names``.
+    """
+    if method not in _methods:
+        raise ValueError('Unknown pre-pacing method: ' + str(method))
+
+    # Load, convert, and compile
+    models = {}
+    simulations = {}
+    todo = []
+    for name, fname in model_names.items():
+        model = myokit.load_model(os.path.join(path, fname))
+        if isinstance(preprocess, dict):
+            if name in preprocess:
+                preprocess[name](model)
+        elif preprocess is not None:
+            preprocess(name, model)
+        if isinstance(current_variables, dict):
+            convert_units(model, current_variables[name])
+        else:
+            convert_units(model, current_variables(model))
+        models[name] = model
+        simulations[name] = create_simulation(model, protocol, cache)
+
+        pp = pre_pace.get(name, True) if isinstance(pre_pace, dict) \
+            else pre_pace
+        if not pp or 'koiv' in model.name():
+            print('NOT Pre-pacing: ' + model.name())
+            continue
+        state_path = None
+        if cache:
+            state_path = _state_path(model, protocol, accelerate, method)
+        if state_path is not None and os.path.isfile(state_path):
+            _load_state(model, state_path)
+        else:
+            print('Pre-pacing: ' + model.name())
+            emit('cache', model.name(), kind='state', hit=False)
+            todo.append((name, state_path))
+
+    # Pre-pace in parallel
+    if todo:
+        jobs = [(models[x], protocol, simulations[x], accelerate, method)
+                for x, _ in todo]
+        if method == 'periodic_orbit':
+            jobs = [job + (processes, ) for job in jobs]
+            processes = 1
+        states = list(fork_map(lambda job: _pre_pace(*job), jobs, processes))
+        for (name, state_path), state in zip(todo, states):
+            _store_state(models[name], state, state_path)
+            print(models[name].format_state(models[name].state()))
+
+    for name, model in models.items():
+        _reset_simulation(simulations[name], model, tolerance)
+    return models, simulations
+
+
+def create_simulation(model, protocol, cache=True):
+    """
+    Creates a :class:`myokit.Simulation` for ``model`` and ``protocol``.
+
+    If ``cache=True``, the compiled simulation is stored in the ``cache_dir``
+    and loaded from there on subsequent calls with the same model, instead of
+    being recompiled. Solver settings such as tolerances are not part of the
+    compiled code, and so need to be set on the returned simulation.
+    """
+    if not cache:
+        return myokit.Simulation(model, protocol)
+
+    path = cache_path('simulations', simulation_key(model), '.zip')
+    if os.path.isfile(path):
+        try:
+            s = myokit.Simulation.from_path(path)
+        except Exception as e:
+            print('Unable to load cached simulation: ' + str(e))
+        else:
+            print('Loaded cached simulation: ' + model.name())
+            emit('cache', model.name(), kind='simulation', hit=True)
+            os.utime(path)
+            s.set_protocol(protocol)
+            s.set_state(model.state())
+            s.set_default_state(model.state())
+            return s
+
+    emit('cache', model.name(), kind='simulation', hit=False)
+    t = time.perf_counter()
+    s = myokit.Simulation(model, protocol, path=path)
+    emit('compile', model.name(), wall_time=time.perf_counter() - t)
+    evict('simulations')
+    return s
+
+
+def convert_units(model, currents):
+    """
+    Converts the units of time, ``membrane_potential``, and all variables in
+    ``currents`` in the given ``model`` to ms, mV, and A/F respectively.
     """
     # Get model variables
     t = model.timex()
@@ -97,13 +300,138 @@ def prepare_model(model, protocol, currents, pre_pace=True):
         var.convert_unit(i_unit, helpers=helpers)
     t.convert_unit('ms')
 
-    # Pre-pace
-    if pre_pace and not 'koiv' in model.name():
-        print('Pre-pacing: ' + model.name())
-        model.set_state(limit_cycle(model, protocol))
-        print(model.format_state(model.state()))
-    else:
-        print('NOT Pre-pacing: ' + model.name())
+
+def _state_path(model, protocol, accelerate=False, method='limit_cycle'):
+    """ Returns the cache path for the pre-paced state of ``model``. """
+    key = state_key(model, protocol, accelerate=accelerate, method=method)
+    return cache_path('states', key, '.txt')
+
+
+def _load_state(model, path):
+    """ Sets the state of ``model`` from the cached state at ``path``. """
+    print('Loading cached state: ' + model.name())
+    emit('cache', model.name(), kind='state', hit=True)
+    model.set_state(myokit.load_state(path))
+    os.utime(path)
+
+
+def _store_state(model, state, path=None):
+    """ Sets the state of ``model`` and caches it at ``path``, if given. """
+    model.set_state(state)
+    if path is not None:
+        myokit.save_state(path, state)
+        evict('states')
+
+
+def _reset_simulation(simulation, model, tolerance):
+    """
+    Sets the default state of ``simulation`` to the state of ``model``, sets
+    its tolerance, resets it, and returns it.
+    """
+    simulation.set_tolerance(*tolerance)
+    simulation.set_default_state(model.state())
+    simulation.reset()
+    return simulation
+
+
+# Pre-pacing methods that can be used by prepare_model and prepare_models
+_methods = ('limit_cycle', 'periodic_orbit')
+
+
+def _pre_pace(model, protocol, simulation, accelerate=False,
+              method='limit_cycle', processes=None):
+    """
+    Returns the steady state found with :meth:`limit_cycle` or
+    :meth:`periodic_orbit`.
+
+    If :meth:`periodic_orbit` finds an orbit that is not reproduced by
+    ordinary pacing (e.g. because it is unstable), :meth:`limit_cycle` is used
+    instead, so that no such state is cached. It starts from the last (best)
+    Newton iterate, which is set as the state of ``model``.
+    """
+    t = time.perf_counter()
+    state = None
+    if method == 'periodic_orbit':
+        state, info = periodic_orbit(
+            model, protocol, simulation=simulation, processes=processes,
+            diagnostics=True)
+        if info['status'] != 'converged':
+            print('Falling back to limit_cycle: ' + model.name())
+            model.set_state(state)
+            state = None
+    if state is None:
+        state = limit_cycle(
+            model, protocol, simulation=simulation, accelerate=accelerate)
+    emit('pre_pace', model.name(), method=method,
+         wall_time=time.perf_counter() - t)
+    return state
+
+
+def fork_map(func, jobs, processes=None, chunksize=1, ordered=True):
+    """
+    Returns an iterator over ``func(job)`` for every job in ``jobs``,
+    evaluated in a pool of at most ``processes`` worker processes (defaults
+    to the number of CPUs).
+
+    The workers are forked from the current process, and started before this
+    method returns. As a result, ``func`` and ``jobs`` are shared with the
+    workers without pickling, so that they can use e.g. compiled simulations
+    or local functions. Only the results are sent back, and must be
+    picklable. Jobs are sent to the workers in chunks of ``chunksize`` (or,
+    if ``None``, in about four chunks per worker), and with ``ordered=False``
+    results are returned as soon as they are ready instead of in the order of
+    ``jobs``.
+
+    If forking is not supported, only one process is used, or this is called
+    from a worker process, the jobs are run in the current process, as the
+    iterator is consumed.
+    """
+    jobs = list(jobs)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(jobs))
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        processes = 1
+    if multiprocessing.current_process().daemon:
+        processes = 1
+    if processes < 2:
+        return (func(job) for job in jobs)
+
+    global _fork_id
+    _fork_id += 1
+    key = _fork_id
+    _fork_jobs[key] = (func, jobs)
+    try:
+        pool = multiprocessing.get_context('fork').Pool(processes)
+    except BaseException:
+        del _fork_jobs[key]
+        raise
+    if chunksize is None:
+        chunksize = max(1, len(jobs) // (4 * processes))
+    imap = pool.imap if ordered else pool.imap_unordered
+    tasks = [(key, i) for i in range(len(jobs))]
+    return _fork_results(pool, imap(_fork_job, tasks, chunksize), key)
+
+
+def _fork_results(pool, results, key):
+    """ Yields ``results`` from ``pool``, and shuts it down when done. """
+    try:
+        with pool:
+            yield from results
+    finally:
+        del _fork_jobs[key]
+
+
+def _fork_job(task):
+    """ Runs the ``i``-th job of the :meth:`fork_map` call ``key``. """
+    key, i = task
+    func, jobs = _fork_jobs[key]
+    return func(jobs[i])
+
+
+# Functions and jobs of active fork_map calls, shared with forked workers
+_fork_jobs = {}
+_fork_id = 0
 
 
 def demote(var):
@@ -128,7 +456,9 @@ def demote(var):
 
 
 def limit_cycle(model, protocol, cl=None, rel_tol=1e-5, max_beats=20000,
-                max_period=10, path=None):
+                max_period=10, path=None, tolerance=(1e-9, 1e-9),
+                simulation=None, accelerate=False, early_stop=True,
+                diagnostics=False):
     """
     Pre-paces a model to periodic orbit ("steady state").
 
@@ -140,11 +470,58 @@ def limit_cycle(model, protocol, cl=None, rel_tol=1e-5, max_beats=20000,
     ``max_beats``
     ``max_period``
     ``path``
+    ``tolerance``
+    ``simulation``
+    ``accelerate``
+    ``early_stop``
+    ``diagnostics``
+
+    If a ``simulation`` for ``model`` and ``protocol`` is given, this will be
+    used instead of compiling a new one. Its tolerance, time, and state will
+    be changed.
+
+    If ``accelerate=True``, states that drift slowly and monotonically towards
+    a fixed point are extrapolated to it after every ``max_period`` beats that
+    did not reach a periodic orbit (see :meth:`extrapolate`). Convergence is
+    always checked using ordinary (non-extrapolated) beats.
+
+    The residuals of every chunk of ``max_period`` beats are kept. With
+    ``early_stop=True``, pre-pacing is stopped as soon as they show that
+    ``rel_tol`` will not be reached within ``max_beats`` (see
+    :meth:`convergence`). This is checked only after ``max_beats // 10``
+    beats, so that initial transients are ignored.
+
+    Returns the final state or, if ``diagnostics=True``, a tuple
+    ``(state, diagnostics)`` where ``diagnostics`` is a dict with entries:
+
+    ``status``
+        One of ``'converged'``, ``'alternans'`` (a period above 1 was found),
+        ``'too_slow'``, ``'stagnated'``, ``'chaotic'`` (stopped early, see
+        :meth:`convergence`), or ``'max_beats'``.
+    ``period``
+        The detected period, or 0.
+    ``beats``
+        The number of beats simulated.
+    ``residual``
+        The final maximum normalised difference (for the best period).
+    ``rate``, ``beats_remaining``
+        The estimated convergence rate and remaining number of beats, see
+        :meth:`convergence` (``None`` if not estimated).
+    ``history``
+        An array of shape ``(chunks, states)`` with the normalised difference
+        of every state (for the best period) after every chunk of beats.
+    ``states``
+        The names of the states, in the order used in ``history``.
     """
 
     # Create simulation
-    s = myokit.Simulation(model, protocol)
-    s.set_tolerance(1e-9, 1e-9)
+    s = simulation
+    if s is None:
+        s = myokit.Simulation(model, protocol)
+    else:
+        s.set_time(0)
+        s.set_state(model.state())
+    s.set_tolerance(*tolerance)
     if cl is None:
         cl = protocol.characteristic_time()
 
@@ -165,73 +542,1015 @@ def limit_cycle(model, protocol, cl=None, rel_tol=1e-5, max_beats=20000,
     scale = np.max(x, axis=1) - np.min(x, axis=1)
     scale[scale==0] = 1
 
+    # Diagnostics
+    info = {
+        'status': 'max_beats',
+        'period': 0,
+        'beats': 0,
+        'residual': None,
+        'rate': None,
+        'beats_remaining': None,
+        'history': np.zeros((0, len(states))),
+        'states': [var.qname() for var in states],
+    }
+
     # Check if already at steady-state
     d = s.run(2 * cl, log_interval=cl, log=myokit.LOG_STATE)
     x = np.array([d[var] for var in states]).T
     dx = np.abs(x[0] - x[1]) / scale
     if np.max(dx) < rel_tol:
-        return s.state() if loaded is None else loaded
+        info.update(status='converged', period=1, residual=float(np.max(dx)))
+        emit('limit_cycle', model.name(), beats=0, period=1,
+             residual=info['residual'], status=info['status'])
+        state = s.state() if loaded is None else loaded
+        return (state, info) if diagnostics else state
+
+    # Ring buffer of states at the start of each beat, holding two chunks of
+    # max_period beats each
+    size = 2 * max_period
+    x = np.empty((size, len(states)))
+
+    # Residuals per chunk, and chunk at which the current trend started
+    history = []
+    start = 0
+    window = 20
 
     beats = 0
+    filled = 0
     period = 0
+    residuals = None
     duration = max_period * cl
     while beats < max_beats:
 
-        # Run and capture a number of beats
+        # Run and capture a number of beats, into the oldest half of the buffer
+        t = time.perf_counter()
         d = s.run(duration, log_interval=cl, log=myokit.LOG_STATE)
+        i = beats % size
+        np.stack([d[var][:max_period] for var in states], axis=1,
+                 out=x[i:i + max_period])
         beats += max_period
-        x = np.array([d[var] for var in states]).T
-
-        # Check to see if any of the beats are a repeat of the first beat
-        period = 0
-        for i in range(1, max_period):
-            dx = np.abs(x[0] - x[i]) / scale
-            if np.max(dx) < rel_tol:
-                period = i
-                break
+        filled = min(filled + max_period, size)
 
-        # Repeat found! Check if there's a second repeat
+        # Check all possible periods at once, using the beats in order
+        order = (np.arange(size) + i + max_period) % size
+        period, residuals = periodicity(
+            x[order[-filled:]], scale, rel_tol, max_period)
+        emit('beats', model.name(), beats=beats, period=period,
+             residual=_residual(residuals),
+             wall_time=time.perf_counter() - t)
+        if residuals.size:
+            history.append(residuals[np.argmin(np.max(residuals, axis=1))])
         if period > 0:
-            # Simulate more beats if needed
-            if 2 * period > max_period:
-                d = s.run(duration, log_interval=cl, log=myokit.LOG_STATE)
-                beats += max_period
-                x = np.concatenate((x, np.array([d[var] for var in states]).T))
-
-            dx = np.abs(x[period] - x[2 * period]) / scale
-            if np.max(dx) < rel_tol:
-                print('Terminating after ' + str(beats) + ' beats')
+            print('Terminating after ' + str(beats) + ' beats')
+            break
+
+        # Stop if the tolerance can't be reached in time
+        if early_stop and beats >= max_beats // 10 and (
+                len(history) - start >= window):
+            status, rate, remaining = convergence(
+                history[-window:], rel_tol, max_period)
+            info.update(rate=rate, beats_remaining=remaining)
+            if remaining is None or beats + remaining > max_beats:
+                info['status'] = status
+                print('Stopping early after ' + str(beats) + ' beats: '
+                      + status.replace('_', ' '))
                 break
-            else:
-                period = 0
+
+        # Jump towards the fixed point, and discard the beats before the jump
+        if accelerate:
+            y, jumped = extrapolate(x[i:i + max_period])
+            if np.any(jumped):
+                print('Extrapolated ' + str(np.sum(jumped)) + ' states after '
+                      + str(beats) + ' beats')
+                s.set_state(y)
+                filled = 0
+                start = len(history)
 
     # Save state to file
     if path is not None:
         print('Saving final state to ' + str(path))
         myokit.save_state(path, s.state())
 
+    if period == 1:
+        info['status'] = 'converged'
+    elif period > 1:
+        info['status'] = 'alternans'
+    info.update(period=period, beats=beats, residual=_residual(residuals))
+    if history:
+        info['history'] = np.array(history)
+    emit('limit_cycle', model.name(), beats=beats, period=period,
+         residual=info['residual'], status=info['status'])
+
     if period > 1:
         print('WARNING: Detected alternans with period ' + str(period) + '.')
     elif period == 0:
-        print('WARNING: Terminating after maximum number of beats.')
-        dx = np.abs(x[0] - x[i]) / scale
-        print('Final dx: ' + str(np.max(dx)))
-
-    return s.state()
-
-
-def guess_currents(model):
-    """ Guess all transmembrane currents in a given ``model``. """
-    def rec(parent, currents=set()):
-        for var in parent.refs_to():
-            if 'tot' in var.name():
-                rec(var, currents)
-            else:
-                currents.add(var)
-        return currents
-
-    currents = rec(model.labelx('cellular_current'))
-    currents = [x.qname() for x in currents]
-    currents.sort()
+        if info['status'] == 'max_beats':
+            print('WARNING: Terminating after maximum number of beats.')
+        else:
+            print('WARNING: Unable to reach tolerance, status: '
+                  + info['status'] + '.')
+        if history:
+            dx = history[-1]
+            print('Final dx: ' + str(np.max(dx)))
+            for j in np.argsort(dx)[::-1][:5]:
+                print('  ' + states[j].qname() + ': ' + str(dx[j]))
+
+    return (s.state(), info) if diagnostics else s.state()
+
+
+def convergence(history, rel_tol, beats_per_chunk=1, chaos=0.2):
+    """
+    Estimates how the residuals in ``history`` converge to ``rel_tol``.
+
+    Arguments
+    ``history``
+        An array of shape ``(chunks, states)`` with the normalised difference
+        of each state after every chunk of beats, as stored by
+        :meth:`limit_cycle`.
+    ``rel_tol``
+        The tolerance that the maximum difference needs to reach.
+    ``beats_per_chunk``
+        The number of beats in each chunk.
+    ``chaos``
+        The standard deviation of the logarithm of the maximum difference
+        around its trend, above which a lack of convergence is called
+        chaotic.
+
+    A straight line is fitted to the logarithm of the maximum difference, as
+    expected for linear convergence. If the fit shows a significant decrease,
+    the number of beats needed to reach ``rel_tol`` is estimated. If not, the
+    residuals are said to have stagnated or, if they fluctuate strongly, to
+    be chaotic.
+
+    Returns a tuple ``(status, rate, remaining)`` where ``status`` is one of
+    ``'too_slow'`` (converging), ``'stagnated'``, or ``'chaotic'``, ``rate``
+    is the estimated factor by which the difference decreases per beat, and
+    ``remaining`` is the estimated number of beats needed to reach
+    ``rel_tol`` (or ``None`` if not converging).
+    """
+    r = np.log(np.maximum(np.max(history, axis=1), 1e-300))
+    c = np.arange(len(r))
+    b, a = np.polyfit(c, r, 1)
+    sigma = np.std(r - (a + b * c))
+    rate = float(np.exp(b / beats_per_chunk))
+    if b >= 0 or -b * (len(r) - 1) < 2 * sigma:
+        return ('chaotic' if sigma > chaos else 'stagnated'), rate, None
+    remaining = (np.log(rel_tol) - (a + b * c[-1])) / b * beats_per_chunk
+    return 'too_slow', rate, max(0, int(np.ceil(remaining)))
+
+
+def periodic_orbit(model, protocol, cl=None, period=1, rel_tol=1e-5,
+                   max_iter=20, pre_beats=10, step=1e-5,
+                   tolerance=(1e-9, 1e-9), simulation=None, processes=None,
+                   diagnostics=False):
+    """
+    Finds a periodic orbit ("steady state") using Newton iterations on the
+    beat map.
+
+    Arguments
+    ``model``
+    ``protocol``
+    ``cl``
+    ``period``
+        The number of beats in the orbit, e.g. 2 to find an alternans orbit.
+    ``rel_tol``
+        The maximum normalised change in any state over one orbit.
+    ``max_iter``
+        The maximum number of Newton iterations.
+    ``pre_beats``
+        The number of ordinary beats to run before starting Newton iterations.
+    ``step``
+        The size of the finite difference steps, relative to each state's
+        scale.
+    ``tolerance``
+    ``simulation``
+    ``processes``
+        The maximum number of worker processes to evaluate the Jacobian with
+        (defaults to the number of CPUs).
+    ``diagnostics``
+
+    The orbit is found as a root of ``f(x) - x``, where the beat map ``f``
+    takes the state at the start of a beat to the state ``period`` beats
+    later. The Jacobian of ``f`` is approximated with forward differences,
+    one column per state, which are evaluated in a pool of worker processes
+    forked from the current process (so that the compiled simulation is
+    re-used). Because many models have conserved quantities, Newton steps are
+    calculated with least squares. Steps that don't reduce the residual are
+    halved, up to 5 times. If none of them reduce it, the iterations are
+    stopped at the last (best) state.
+
+    The result is checked by running ``2 * period + 1`` ordinary beats and
+    calling :meth:`periodicity`. A warning is shown if this fails, e.g.
+    because the orbit found is unstable.
+
+    If a ``simulation`` for ``model`` and ``protocol`` is given, this will be
+    used instead of compiling a new one. Its tolerance, time, and state will
+    be changed.
+
+    Returns the state at the start of the orbit or, if ``diagnostics=True``, a
+    tuple ``(state, diagnostics)`` where ``diagnostics`` is a dict with
+    entries:
+
+    ``status``
+        ``'converged'`` if the orbit was reproduced by ordinary pacing, or
+        ``'not_reproduced'`` if it wasn't.
+    ``iterations``
+        The number of Newton iterations.
+    ``beats``
+        The number of beats simulated (excluding the final check).
+    ``residual``
+        The final maximum normalised change over one orbit.
+    """
+    # Create simulation
+    s = simulation
+    if s is None:
+        s = myokit.Simulation(model, protocol)
+    else:
+        s.set_time(0)
+        s.set_state(model.state())
+    s.set_tolerance(*tolerance)
+    if cl is None:
+        cl = protocol.characteristic_time()
+    duration = period * cl
+
+    # Get scale of each state, and run pre-beats
+    states = list(model.states())
+    d = s.run(cl, log=myokit.LOG_STATE)
+    x = np.array([d[var] for var in states])
+    scale = np.max(x, axis=1) - np.min(x, axis=1)
+    scale[scale==0] = 1
+    if pre_beats > 1:
+        s.run((pre_beats - 1) * cl, log=myokit.LOG_NONE)
+    beats = max(1, pre_beats)
+
+    # Beat map, evaluated in this process or in workers
+    def beat_map(x):
+        s.set_time(0)
+        s.set_state(x)
+        s.run(duration, log=myokit.LOG_NONE)
+        return np.array(s.state())
+
+    x = np.array(s.state())
+    fx = beat_map(x)
+    beats += period
+    residual = np.max(np.abs(fx - x) / scale)
+    iterations = 0
+    while residual >= rel_tol and iterations < max_iter:
+        iterations += 1
+
+        # Approximate Jacobian of f(x) - x
+        h = step * scale
+        xs = list(x + np.diag(h))
+        fxs = list(fork_map(beat_map, xs, processes))
+        beats += period * len(xs)
+        J = ((np.array(fxs) - fx) / h[:, None]).T - np.eye(len(x))
+
+        # Take a (damped) Newton step
+        dx = np.linalg.lstsq(J, x - fx, rcond=None)[0]
+        for i in range(6):
+            y = x + dx
+            fy = beat_map(y)
+            beats += period
+            r = np.max(np.abs(fy - y) / scale)
+            if r < residual:
+                break
+            dx *= 0.5
+        else:
+            print('WARNING: Newton step did not reduce the residual.')
+            break
+        x, fx, residual = y, fy, r
+        print('Newton iteration ' + str(iterations) + ': residual '
+              + str(residual))
+
+    if residual < rel_tol:
+        print('Terminating after ' + str(iterations) + ' iterations ('
+              + str(beats) + ' beats)')
+    else:
+        print('WARNING: Terminating after ' + str(iterations)
+              + ' iterations without reaching tolerance.')
+        print('Final dx: ' + str(residual))
+
+    # Check the orbit with ordinary beats
+    s.set_time(0)
+    s.set_state(x)
+    d = s.run((2 * period + 1) * cl, log_interval=cl, log=myokit.LOG_STATE)
+    y = np.array([d[var] for var in states]).T
+    status = 'converged'
+    if periodicity(y, scale, rel_tol, period + 1)[0] == 0:
+        print('WARNING: Orbit not reproduced by ordinary pacing.')
+        status = 'not_reproduced'
+
+    if diagnostics:
+        return list(x), {
+            'status': status, 'iterations': iterations, 'beats': beats,
+            'residual': float(residual)}
+    return list(x)
+
+
+def extrapolate(x, max_ratio=0.9999, ratio_tol=0.05):
+    """
+    Estimates the fixed point of slowly converging states, using Aitken
+    extrapolation.
+
+    Arguments
+    ``x``
+        An array of shape ``(beats, states)`` with the states at the start of
+        at least 4 successive beats, with the oldest beat first.
+    ``max_ratio``
+        The largest ratio between successive beat-to-beat changes for which
+        a state is extrapolated. This limits each jump to ``max_ratio / (1 -
+        max_ratio)`` times the last change.
+    ``ratio_tol``
+        The maximum relative difference between the last two ratios.
+
+    A state is extrapolated only if its last three changes have the same sign
+    and shrink by a steady ratio ``r`` (so that it converges linearly), in
+    which case its remaining drift ``dx * r / (1 - r)`` is added to its last
+    value.
+
+    Returns a tuple ``(y, jumped)`` where ``y`` is the last beat's state with
+    any extrapolated values, and ``jumped`` is a boolean array indicating
+    which states were extrapolated.
+    """
+    y = np.array(x[-1])
+    if len(x) < 4:
+        return y, np.zeros(y.shape, dtype=bool)
+
+    d1, d2, d3 = np.diff(x[-4:], axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r1 = d2 / d1
+        r2 = d3 / d2
+        jumped = ((d1 * d2 > 0) & (d2 * d3 > 0) & (r2 < max_ratio)
+                  & (np.abs(r1 - r2) < ratio_tol * r2))
+    r = r2[jumped]
+    y[jumped] += d3[jumped] * r / (1 - r)
+    return y, jumped
+
+
+def periodicity(x, scale, rel_tol=1e-5, max_period=10):
+    """
+    Checks if the states at the start of successive beats are on a periodic
+    orbit.
+
+    Arguments
+    ``x``
+        An array of shape ``(beats, states)``, with the oldest beat first.
+    ``scale``
+        The scale to normalise each state's differences with.
+    ``rel_tol``
+        The maximum normalised difference between repeated states.
+    ``max_period``
+        Periods ``1, 2, ..., max_period - 1`` are checked.
+
+    An orbit has period ``k`` if the last beat matches the beat ``k`` beats
+    before it, which in turn matches the beat ``2k`` beats before the last.
+    All periods for which there are enough beats are checked at once.
+
+    Returns a tuple ``(period, residuals)`` where ``period`` is the smallest
+    period found (or 0 if none), and ``residuals`` is an array of shape
+    ``(periods, states)`` with the normalised difference for each checked
+    period and each state.
+    """
+    k = np.arange(1, max_period)
+    k = k[2 * k < len(x)]
+    y = x[-1 - np.concatenate(([0], k, 2 * k))] / scale
+    n = len(k)
+    residuals = np.maximum(
+        np.abs(y[0] - y[1:1 + n]), np.abs(y[1:1 + n] - y[1 + n:]))
+    found = np.max(residuals, axis=1) < rel_tol
+    period = int(k[np.argmax(found)]) if np.any(found) else 0
+    return period, residuals
+
+
+# Units that transmembrane currents can be expressed in
+current_units = (
+    myokit.units.A,
+    myokit.units.A / myokit.units.F,
+    myokit.units.A / myokit.units.m**2,
+)
+
+
+def _linear_terms(e):
+    """
+    Returns a list of the non-constant variables that expression ``e`` is a
+    linear combination of (with constant coefficients), or ``None`` if it is
+    not such a combination.
+    """
+    if e.is_constant():
+        return []
+    if isinstance(e, myokit.Name):
+        return [e.var()]
+    if isinstance(e, (myokit.PrefixPlus, myokit.PrefixMinus)):
+        return _linear_terms(e[0])
+    if isinstance(e, (myokit.Plus, myokit.Minus)):
+        a, b = _linear_terms(e[0]), _linear_terms(e[1])
+        return None if a is None or b is None else a + b
+    if isinstance(e, myokit.Multiply):
+        if e[0].is_constant():
+            return _linear_terms(e[1])
+        if e[1].is_constant():
+            return _linear_terms(e[0])
+    elif isinstance(e, myokit.Divide) and e[1].is_constant():
+        return _linear_terms(e[0])
+    return None
+
+
+def current_index(model):
+    """
+    Returns an index of the dependency graph of ``model``, used by
+    :meth:`guess_currents`.
+
+    The index is a dict mapping the qualified name of every variable to a
+    tuple ``(terms, current, paced)``, where:
+
+    ``terms``
+        A tuple with the qualified names of the non-constant variables that
+        the variable's right-hand side is a linear combination of (e.g. the
+        currents in a sum of currents), or ``None`` if it is not a linear
+        combination.
+    ``current``
+        ``True`` if the variable could be a current: it is not a state, not
+        constant, and either has no unit or a unit that can be converted to
+        one of the ``current_units``.
+    ``paced``
+        ``True`` if the variable is bound to the pacing signal or depends on
+        it (e.g. the stimulus current).
+
+    Building the index visits every variable and every reference once.
+    """
+    index = {}
+    for var in model.variables(deep=True):
+        terms = None if var.is_state() else _linear_terms(var.rhs())
+        if terms is not None:
+            terms = tuple(dict.fromkeys(x.qname() for x in terms))
+        unit = var.unit()
+        current = not (var.is_state() or var.is_constant()) and (
+            unit is None or any(
+                myokit.Unit.can_convert(unit, x) for x in current_units))
+        index[var.qname()] = [terms, current, False]
+
+    # Mark everything that depends on the pacing signal
+    pace = model.binding('pace')
+    todo = [] if pace is None else [pace]
+    while todo:
+        var = todo.pop()
+        if not index[var.qname()][2]:
+            index[var.qname()][2] = True
+            todo.extend(var.refs_by())
+    return {k: tuple(v) for k, v in index.items()}
+
+
+def guess_currents(model, index=None):
+    """
+    Guess all transmembrane currents in a given ``model``, and return a sorted
+    list of their qualified names.
+
+    Currents are found by structure and units, rather than by name: starting
+    from the variable labelled ``cellular_current`` (or, if there is none,
+    from the derivative of the ``membrane_potential``), every term of a
+    linear combination of currents is visited. Terms that are themselves
+    sums of currents from other components (e.g. a total potassium current),
+    or sums in the same component as the starting point, are expanded, while
+    the remaining terms are returned. As a result, a current made up of parts
+    in its own component (e.g. junctional and subsarcolemmal fluxes) is kept
+    whole. Stimulus currents (which depend on the pacing signal or are
+    labelled ``stimulus_current``) and bound variables (e.g. a diffusion
+    current) are ignored.
+
+    An ``index`` from :meth:`current_index` can be passed in to avoid
+    rebuilding it. Each variable and reference is visited at most once.
+    """
+    if index is None:
+        index = current_index(model)
+    root = model.label('cellular_current')
+    if root is None:
+        root = model.labelx('membrane_potential')
+        terms = _linear_terms(root.rhs())
+        if terms is not None:
+            terms = [x.qname() for x in terms]
+    else:
+        terms = index[root.qname()][0]
+    if terms is None:
+        raise ValueError(
+            'Unable to find currents in ' + model.name() + ': '
+            + root.qname() + ' is not a sum of currents.')
+    top = root.parent().qname()
+
+    currents = set()
+    seen = set()
+    todo = [x for x in terms if not _ignored(model, x, index)]
+    while todo:
+        qname = todo.pop()
+        if qname in seen:
+            continue
+        seen.add(qname)
+        terms, current = index[qname][:2]
+        component = qname.rsplit('.', 1)[0]
+        if terms and all(index[x][1] for x in terms) and (
+                component == top
+                or any(x.rsplit('.', 1)[0] != component for x in terms)):
+            todo.extend(x for x in terms if not _ignored(model, x, index))
+        elif current:
+            currents.add(qname)
+    return sorted(currents)
+
+
+def _ignored(model, qname, index):
+    """
+    Returns ``True`` if the variable ``qname`` is not a candidate current:
+    if it depends on the pacing signal, is bound, or is labelled as the
+    stimulus current.
+    """
+    var = model.get(qname)
+    return index[qname][2] or var.binding() is not None or (
+        var.label() == 'stimulus_current')
+
+
+def scan_currents(paths, processes=None):
+    """
+    Loads every model file in ``paths`` and runs :meth:`guess_currents` on
+    it, in a pool of at most ``processes`` worker processes (defaults to the
+    number of CPUs).
+
+    Returns a dict mapping each path to a sorted list of current names, or to
+    ``None`` if the model could not be loaded or no currents were found.
+    """
+    paths = list(paths)
+    return dict(zip(paths, fork_map(_scan_job, paths, processes)))
+
+
+def _scan_job(path):
+    """ Returns the currents in the model at ``path``, or ``None``. """
+    try:
+        currents = guess_currents(myokit.load_model(path))
+    except (myokit.MyokitError, ValueError) as e:
+        print('WARNING: Unable to scan ' + path + ': '
+              + str(e).split('\n')[0])
+        return None
+    if not currents:
+        print('WARNING: No currents found in ' + path)
+        return None
     return currents
 
+
+def state_key(model, protocol, cl=None, rel_tol=1e-5, max_beats=20000,
+              max_period=10, tolerance=(1e-9, 1e-9), accelerate=False,
+              method='limit_cycle'):
+    """
+    Returns a key identifying the limit cycle found by :meth:`limit_cycle`
+    when called with the same arguments (or by :meth:`periodic_orbit`, if
+    ``method='periodic_orbit'``).
+
+    The key is a hash of the model and protocol code (so that it changes when
+    e.g. units are converted), the pre-pacing settings, the source of the
+    pre-pacing functions (so that it changes when the solver does), and the
+    myokit version.
+    """
+    if cl is None:
+        cl = protocol.characteristic_time()
+    source = [inspect.getsource(f) for f in (
+        limit_cycle, convergence, periodicity, extrapolate, _residual,
+        periodic_orbit)]
+    return cache_key(
+        model.code(), protocol.code(), cl, rel_tol, max_beats, max_period,
+        tolerance, accelerate, method, source, myokit.__version__)
+
+
+def simulation_key(model):
+    """
+    Returns a key identifying the compiled simulation of ``model`` created by
+    :meth:`create_simulation`.
+
+    The key is a hash of the model code, the myokit and Python versions, and
+    the platform the simulation was compiled on.
+    """
+    return cache_key(
+        model.code(), myokit.__version__, sys.version, platform.platform())
+
+
+def cache_key(*parts):
+    """ Returns a hex digest identifying the given ``parts``. """
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def cache_path(kind, key, ext=''):
+    """
+    Returns a path for the cached object of the given ``kind`` (a subdirectory
+    of ``cache_dir``) with the given ``key`` and extension ``ext``.
+
+    The subdirectory is created if it doesn't exist.
+    """
+    root = os.path.join(cache_dir, kind)
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    return os.path.join(root, key + ext)
+
+
+def evict(kind, max_size=None):
+    """
+    Removes the least recently used files from the cache subdirectory ``kind``
+    until its total size is at most ``max_size`` bytes (defaults to
+    ``cache_size``).
+    """
+    if max_size is None:
+        max_size = cache_size
+    root = os.path.join(cache_dir, kind)
+    if not os.path.isdir(root):
+        return
+
+    # Entries may be removed concurrently by other processes
+    entries = []
+    for fname in os.listdir(root):
+        path = os.path.join(root, fname)
+        try:
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+            elif os.path.isdir(path):
+                size = sum(os.path.getsize(os.path.join(path, x))
+                           for x in os.listdir(path))
+                entries.append((os.stat(path).st_mtime, size, path))
+        except FileNotFoundError:
+            pass
+    entries.sort()
+
+    total = sum(x[1] for x in entries)
+    for mtime, size, path in entries:
+        if total <= max_size:
+            break
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+
+
+def store_traces(key, log, columns=None):
+    """
+    Stores the :class:`myokit.DataLog` ``log`` in the trace store, under the
+    given ``key``.
+
+    Each variable is written to its own ``.npy`` file in the directory
+    ``cache/traces/<key>``, so that it can be memory-mapped by
+    :meth:`load_traces`. The variable names are listed in ``columns.txt``,
+    starting with the time, followed by the names in ``columns`` (if given)
+    or by all other variables in ``log``. The log returned by
+    :meth:`load_traces` has the same order.
+    """
+    path = cache_path('traces', key)
+    temp = path + '.tmp'
+    if os.path.isdir(temp):
+        shutil.rmtree(temp)
+    os.makedirs(temp)
+    time_key = log.time_key()
+    if columns is None:
+        columns = log
+    with open(os.path.join(temp, 'columns.txt'), 'w') as f:
+        for k in [time_key] + [x for x in columns if x != time_key]:
+            np.save(os.path.join(temp, k + '.npy'), np.asarray(log[k]))
+            f.write(k + '\n')
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.rename(temp, path)
+    evict('traces')
+
+
+def load_traces(key, mmap=True):
+    """
+    Returns a :class:`myokit.DataLog` with the traces stored under ``key`` by
+    :meth:`store_traces`, or ``None`` if no such traces exist.
+
+    By default the arrays are read-only memory maps, so that only the parts
+    actually used are read from disk. Set ``mmap=False`` to load them into
+    memory instead.
+    """
+    path = cache_path('traces', key)
+    index = os.path.join(path, 'columns.txt')
+    if not os.path.isfile(index):
+        return None
+    with open(index, 'r') as f:
+        columns = f.read().split()
+    log = myokit.DataLog(time=columns[0])
+    mode = 'r' if mmap else None
+    for k in dict.fromkeys(columns):
+        log[k] = np.load(os.path.join(path, k + '.npy'), mmap_mode=mode)
+    os.utime(path)
+    return log
+
+
+def relative_contributions(currents, out=None):
+    """
+    Returns the relative contribution of each current to the total outward or
+    inward current at every point in time.
+
+    ``currents`` must be an array of shape ``(..., currents, times)``, so that
+    many cells or models can be processed in a single call (models with fewer
+    currents can be padded with zeros, see :meth:`align_contributions`). The
+    returned array has the same shape, with positive values indicating a
+    fraction of the total outward current, and negative values indicating a
+    fraction of the total inward current (normalised as in
+    :meth:`myokit.lib.plots.cumulative_current`).
+
+    If given, the result is written into the preallocated array ``out``.
+    """
+    currents = np.asarray(currents, dtype=float)
+    if out is None:
+        out = np.empty(currents.shape)
+    elif out.shape != currents.shape:
+        raise ValueError(
+            'Output array must have shape ' + str(currents.shape) + '.')
+
+    mask = currents > 0
+    pos = np.sum(currents, axis=-2, keepdims=True, where=mask)
+    neg = np.sum(currents, axis=-2, keepdims=True, where=~mask)
+    np.maximum(pos, 1e-99, out=pos)
+    np.minimum(neg, -1e-99, out=neg)
+    np.negative(neg, out=neg)
+    np.divide(currents, pos, out=out, where=mask)
+    np.divide(currents, neg, out=out, where=~mask)
+    return out
+
+
+def stacked_contributions(currents, out=None):
+    """
+    Returns the edges of the stacked outward and inward relative contributions
+    of ``currents``, as drawn by :meth:`myokit.lib.plots.cumulative_current`.
+
+    ``currents`` must be an array of shape ``(..., currents, times)``, and the
+    returned array has shape ``(..., 2, currents + 1, times)``. The entries
+    ``[..., 0, k, :]`` and ``[..., 0, k + 1, :]`` are the lower and upper
+    edges of the outward band for the ``k``-th current, which runs upwards
+    from zero. Similarly, ``[..., 1, k, :]`` and ``[..., 1, k + 1, :]`` are
+    the upper and lower edges of its inward band, which runs downwards from
+    zero.
+
+    If given, the result is written into the preallocated array ``out``.
+    """
+    currents = np.asarray(currents, dtype=float)
+    shape = currents.shape[:-2] + (2, currents.shape[-2] + 1,
+                                   currents.shape[-1])
+    if out is None:
+        out = np.empty(shape)
+    elif out.shape != shape:
+        raise ValueError('Output array must have shape ' + str(shape) + '.')
+
+    up = out[..., 0, 1:, :]
+    down = out[..., 1, 1:, :]
+    relative_contributions(currents, out=up)
+    np.minimum(up, 0, out=down)
+    np.maximum(up, 0, out=up)
+    np.cumsum(up, axis=-2, out=up)
+    np.cumsum(down, axis=-2, out=down)
+    out[..., 0, 0, :] = 0
+    out[..., 1, 0, :] = 0
+    return out
+
+
+def decimate(x, y, tolerance):
+    """
+    Returns the indices of a subset of the points ``x`` such that linearly
+    interpolating between them deviates from every curve in ``y`` by at most
+    ``tolerance``.
+
+    ``x`` must be a non-decreasing array of ``points`` values and ``y`` an
+    array of shape ``(..., points)``. All curves are decimated together, using
+    the Ramer-Douglas-Peucker algorithm with vertical distances, so that the
+    result can be used for stacked plots (e.g. with the edges returned by
+    :meth:`stacked_contributions`).
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float).reshape(-1, len(x))
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    segments = [(0, n - 1)]
+    while segments:
+        i, j = segments.pop()
+        if j - i < 2:
+            continue
+        dx = x[j] - x[i]
+        w = (x[i + 1:j] - x[i]) / dx if dx > 0 else np.zeros(j - i - 1)
+        line = y[:, i:i + 1] * (1 - w) + y[:, j:j + 1] * w
+        error = np.max(np.abs(y[:, i + 1:j] - line), axis=0)
+        k = np.argmax(error)
+        if error[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            segments.append((i, k))
+            segments.append((k, j))
+    return np.nonzero(keep)[0]
+
+
+def log_variables(model, currents):
+    """
+    Returns a list of variables to log to calculate the contributions of
+    ``currents``: the time variable followed by all currents.
+    """
+    return [model.timex().qname()] + list(currents)
+
+
+def log_times(protocol, duration, interval=1, dense_interval=0.01,
+              dense_duration=2, t0=0):
+    """
+    Returns an array of times to log at, using a fixed ``interval`` but
+    switching to a smaller ``dense_interval`` for ``dense_duration`` after the
+    start of every event in the ``protocol``.
+
+    Logs made with the same protocol and arguments share the same times, so
+    that they can be compared without interpolation.
+
+    Arguments
+    ``protocol``
+    ``duration``
+        The duration to log (starting from ``t0``).
+    ``interval``
+    ``dense_interval``
+    ``dense_duration``
+    ``t0``
+    """
+    tmax = t0 + duration
+    times = [t0 + np.arange(0, duration, interval)]
+    for e in protocol.events():
+        start = e.start()
+        k = 0
+        while start < tmax:
+            if start + dense_duration > t0:
+                times.append(
+                    start + np.arange(0, dense_duration, dense_interval))
+            k += 1
+            if e.period() == 0 or (e.multiplier() and k >= e.multiplier()):
+                break
+            start = e.start() + k * e.period()
+    times = np.unique(np.round(np.concatenate(times), 9))
+    return times[(times >= t0) & (times < tmax)]
+
+
+def align_contributions(contributions, keys, all_keys):
+    """
+    Returns an array of shape ``(..., len(all_keys), times)`` with the
+    ``contributions`` of the currents named in ``keys`` (e.g. ``'I_Kr'``)
+    moved to their position in ``all_keys``, and zeros for any currents in
+    ``all_keys`` not in ``keys``.
+
+    This can be used to stack the contributions of different models logged
+    at the same times.
+    """
+    contributions = np.asarray(contributions)
+    shape = list(contributions.shape)
+    shape[-2] = len(all_keys)
+    out = np.zeros(shape)
+    out[..., [all_keys.index(k) for k in keys], :] = contributions
+    return out
+
+
+def iter_contributions(simulation, model, currents, duration, chunk=100,
+                       log_interval=None, log_times=None):
+    """
+    Runs a ``simulation`` of ``model`` for the given ``duration``, and yields
+    the relative contributions of the given ``currents`` in chunks.
+
+    Arguments
+    ``simulation``
+        A simulation of ``model``, which will be run from its current time and
+        state.
+    ``model``
+    ``currents``
+    ``duration``
+    ``chunk``
+        The duration of each chunk.
+    ``log_interval``
+        An optional fixed interval to log at. If not set, every solver step is
+        logged.
+    ``log_times``
+        An optional sequence of times to log at, e.g. as returned by
+        :meth:`log_times`. Cannot be used in combination with
+        ``log_interval``.
+
+    Only the time and ``currents`` are logged, so that memory use depends on
+    the number of currents rather than the size of the model. Each chunk is
+    normalised with :meth:`relative_contributions` as soon as it has been
+    simulated.
+
+    Yields tuples ``(times, contributions)`` where ``contributions`` has shape
+    ``(currents, times)``.
+    """
+    if log_interval is not None and log_times is not None:
+        raise ValueError(
+            'The arguments log_interval and log_times cannot be used'
+            ' together.')
+    if log_times is not None:
+        log_times = np.asarray(log_times)
+
+    log = log_variables(model, currents)
+    time_key = log[0]
+    tmax = simulation.time() + duration
+    while simulation.time() < tmax:
+        t = simulation.time()
+        step = min(chunk, tmax - t)
+        times = None
+        if log_times is not None:
+            times = log_times[(log_times >= t) & (log_times < t + step)]
+        d = simulation.run(
+            step, log=log, log_interval=log_interval,
+            log_times=times).npview()
+        yield d[time_key], relative_contributions(
+            np.array([d[c] for c in currents]))
+
+
+def run_contributions(simulation, model, currents, duration, chunk=100,
+                      log_interval=None, log_times=None):
+    """
+    Runs a ``simulation`` and returns the relative contributions of
+    ``currents``, using :meth:`iter_contributions`.
+
+    Returns a tuple ``(times, contributions)`` where ``contributions`` has
+    shape ``(currents, times)``.
+    """
+    times, contributions = [], []
+    for t, c in iter_contributions(simulation, model, currents, duration,
+                                   chunk, log_interval, log_times):
+        times.append(t)
+        contributions.append(c)
+    return np.concatenate(times), np.concatenate(contributions, axis=1)
+
+
+def add_sink(sink):
+    """
+    Adds a function ``sink(event)`` that is called with every instrumentation
+    event, and returns it.
+
+    Events are dicts with at least the keys ``event`` (the event type),
+    ``model`` (the model name), ``time`` (a unix timestamp), and ``pid`` (the
+    id of the emitting process). The following events are emitted:
+
+    ``cache``
+        A cached ``kind='simulation'`` or ``kind='state'`` was looked up, with
+        ``hit`` set to ``True`` or ``False``.
+    ``compile``
+        A simulation was compiled, taking ``wall_time`` seconds.
+    ``beats``
+        :meth:`limit_cycle` simulated a chunk of beats, bringing the total to
+        ``beats``, in ``wall_time`` seconds. The ``residual`` is the largest
+        normalised difference for the best matching period, and ``period`` is
+        the detected period (or 0).
+    ``limit_cycle``
+        :meth:`limit_cycle` finished, after ``beats`` beats, with ``period``
+        and ``residual`` as above, and the diagnostic ``status``.
+    ``pre_pace``
+        A model was pre-paced using ``method``, taking ``wall_time`` seconds.
+
+    Sinks are inherited by forked worker processes, and so are called in the
+    process that emits the event (see :meth:`json_sink` to collect events
+    from all processes).
+    """
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    """ Removes a sink added with :meth:`add_sink`. """
+    _sinks.remove(sink)
+
+
+def json_sink(path):
+    """
+    Returns a sink that appends each event to the file at ``path``, as a
+    single line of JSON.
+    """
+    def sink(event):
+        with open(path, 'a') as f:
+            f.write(json.dumps(event) + '\n')
+    return sink
+
+
+def emit(event, model, **fields):
+    """
+    Sends an instrumentation ``event`` for the model named ``model``, with the
+    given ``fields``, to all sinks (see :meth:`add_sink`).
+    """
+    if not _sinks:
+        return
+    fields['event'] = event
+    fields['model'] = model
+    fields['time'] = time.time()
+    fields['pid'] = os.getpid()
+    for sink in _sinks:
+        sink(fields)
+
+
+def _residual(residuals):
+    """
+    Returns the largest residual for the best matching period in
+    ``residuals`` (see :meth:`periodicity`), or ``None``.
+    """
+    if residuals is None or not residuals.size:
+        return None
+    return float(np.min(np.max(residuals, axis=1)))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+#
+# Limit cycles over a range of cycle lengths, warm-started from each other.
+#
+import os
+
+import myokit
+import numpy as np
+
+import registry
+import shared
+
+
+def sweep_order(cls, start):
+    """
+    Returns a list of tuples ``(cl, previous)`` giving the order in which to
+    find limit cycles for the cycle lengths ``cls``, so that each one can
+    start from the converged state at its nearest neighbour ``previous``.
+
+    The sweep starts at the cycle length closest to ``start`` (for which
+    ``previous`` is ``None``), then moves up to the longest cycle length, and
+    finally moves down from ``start`` to the shortest.
+    """
+    cls = np.unique(np.asarray(cls, dtype=float))
+    if len(cls) == 0:
+        return []
+    i = int(np.argmin(np.abs(cls - start)))
+    order = [(cls[i], None)]
+    for j in range(i + 1, len(cls)):
+        order.append((cls[j], cls[j - 1]))
+    for j in range(i - 1, -1, -1):
+        order.append((cls[j], cls[j + 1]))
+    return [(float(a), None if b is None else float(b)) for a, b in order]
+
+
+def sweep_states(model, protocol, cls, start=None, simulation=None,
+                 cache=True):
+    """
+    Finds the limit cycle of ``model`` at every cycle length in ``cls``, using
+    :meth:`shared.limit_cycle`.
+
+    Arguments
+    ``model``
+        A model prepared with :meth:`shared.prepare_model`. Its state is used
+        as the initial state at the first cycle length.
+    ``protocol``
+        A function that returns a :class:`myokit.Protocol` for a given cycle
+        length.
+    ``cls``
+        The cycle lengths to find limit cycles for.
+    ``start``
+        The cycle length closest to the model's current state, at which to
+        start the sweep (defaults to the middle of ``cls``). See
+        :meth:`sweep_order`.
+    ``simulation``
+        An optional simulation for ``model`` to re-use. Its protocol,
+        tolerance, time, and state will be changed.
+    ``cache``
+        Set to ``False`` to disable loading and storing states in the
+        ``shared.cache_dir``.
+
+    Each limit cycle starts from the converged state at the neighbouring
+    cycle length, which usually needs far fewer beats than starting from the
+    same initial state every time. States are cached using a key based on the
+    model (with its initial state) and the protocol, so that a repeated or
+    extended sweep only simulates new cycle lengths.
+
+    Returns a tuple ``(states, beats)``, where ``states`` maps each cycle
+    length to its limit cycle state, and ``beats`` maps it to the number of
+    beats simulated to find it (0 if cached).
+    """
+    order = sweep_order(cls, np.median(cls) if start is None else start)
+    s = simulation
+    if s is None:
+        s = shared.create_simulation(model, protocol(order[0][0]), cache)
+
+    initial = model.state()
+    states = {}
+    beats = {}
+    try:
+        for cl, previous in order:
+            p = protocol(cl)
+            path = None
+            if cache:
+                model.set_state(initial)
+                key = shared.state_key(model, p)
+                path = shared.cache_path('states', key, '.txt')
+            if path is not None and os.path.isfile(path):
+                states[cl] = myokit.load_state(path)
+                beats[cl] = 0
+                os.utime(path)
+                continue
+
+            print('Pre-pacing ' + model.name() + ' at ' + str(cl) + ' ms')
+            model.set_state(initial if previous is None else states[previous])
+            s.set_protocol(p)
+            state, info = shared.limit_cycle(
+                model, p, simulation=s, diagnostics=True)
+            states[cl] = state
+            beats[cl] = info['beats']
+            if path is not None:
+                myokit.save_state(path, state)
+                shared.evict('states')
+    finally:
+        model.set_state(initial)
+
+    order = sorted(states)
+    return {cl: states[cl] for cl in order}, {cl: beats[cl] for cl in order}
+
+
+def sweep(models, protocol, cls, start=None, simulations=None, cache=True,
+          processes=None):
+    """
+    Runs :meth:`sweep_states` for every model in the dict ``models``, and
+    returns a dict mapping the same keys to tuples ``(states, beats)``.
+
+    If given, ``simulations`` must be a dict with a simulation for each model
+    (e.g. as returned by :meth:`shared.prepare_models`). Models are swept in a
+    pool of at most ``processes`` worker processes (defaults to the number of
+    CPUs), forked from the current process so that they can re-use the
+    compiled simulations. If forking is not supported, models are swept one
+    after the other.
+    """
+    names = list(models)
+    if simulations is None:
+        simulations = {}
+        for name in names:
+            cl = np.median(cls) if start is None else start
+            simulations[name] = shared.create_simulation(
+                models[name], protocol(cl), cache)
+
+    jobs = [(models[x], protocol, cls, start, simulations[x], cache)
+            for x in names]
+    results = shared.fork_map(lambda job: sweep_states(*job), jobs, processes)
+    return dict(zip(names, results))
+
+
+def sweep_group(group, cls, names=None, processes=None):
+    """
+    Prepares the models ``names`` (or all models) in ``group`` with
+    :meth:`registry.prepare`, and sweeps them over the cycle lengths ``cls``,
+    starting from their pre-paced states at the group's cycle length.
+
+    Returns a tuple ``(models, results)``, where ``models`` maps model names
+    to prepared models, and ``results`` maps them to tuples
+    ``(states, beats)`` as returned by :meth:`sweep_states`.
+    """
+    models, simulations = registry.prepare(group, names)
+    results = sweep(
+        models, lambda cl: registry.protocol(group, cl), cls,
+        start=registry.groups[group]['cl'], simulations=simulations,
+        processes=processes)
+    return models, results